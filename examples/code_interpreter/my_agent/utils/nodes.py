@@ -1,11 +1,32 @@
+from functools import lru_cache
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
 from langchain_ollama import ChatOllama
 from langgraph.prebuilt import ToolNode, tools_condition
 from langgraph.graph import END
 from my_agent.utils.state import State
+from my_agent.utils.streaming import merge_tool_output, run_tool_calls, stream_with_tools
 from my_agent.utils.tools import CodeInterpreter, human_assistance
 
 tools_list = [CodeInterpreter(), human_assistance]
 tools = ToolNode(tools=tools_list)
+# tools calling `interrupt()`, run one at a time after the other tools
+INTERRUPT_TOOLS = {"human_assistance"}
+# tools sharing the interpreter session of the thread, their calls depend on the earlier ones
+SESSION_TOOLS = {"code_interpreter"}
+
+
+@lru_cache(maxsize=4)
+def _get_model(model_name: str):
+    if model_name == "qwen3":
+        model = ChatOllama(model="qwen3:8b", reasoning=False)
+    else:
+        raise ValueError(f"Unsupported model type: {model_name}")
+
+    # bind tools once, the bound model is shared by every graph step
+    model = model.bind_tools(tools=tools_list)
+    return model
+
 
 def route_tools(state: State):
     """
@@ -14,7 +35,8 @@ def route_tools(state: State):
 
     messages = state.get('messages', [])
     if messages:
-        tool_message = messages[-1]
+        # the tool messages of calls run while streaming follow the AI message
+        tool_message = next((m for m in reversed(messages) if not isinstance(m, ToolMessage)), messages[-1])
         if hasattr(tool_message, 'tool_calls') and len(tool_message.tool_calls) > 0:
             return "tools"
         return END
@@ -22,14 +44,64 @@ def route_tools(state: State):
         raise ValueError("No messages found in state")
 
 
-def chatbot(state: State):
+def _tool_calls(state: State, interrupting: bool):
+    """the unanswered calls of the last AI message to the interrupting or the other tools"""
+    messages = state["messages"]
+    index = next(i for i in reversed(range(len(messages))) if isinstance(messages[i], AIMessage))
+    # calls run while the message was streamed are answered already
+    answered = {m.tool_call_id for m in messages[index + 1:] if isinstance(m, ToolMessage)}
+    return [
+        {**call, "type": "tool_call"} for call in messages[index].tool_calls
+        if (call["name"] in INTERRUPT_TOOLS) == interrupting and call["id"] not in answered
+    ]
+
+
+def run_tools(state: State, config: RunnableConfig):
+    """
+    run the calls to tools which do not interrupt, concurrently in the ToolNode executor,
+    except the calls sharing the interpreter session, which run one at a time in call order.
+    """
+    calls = _tool_calls(state, interrupting=False)
+    if not calls:
+        return {}
+    return run_tool_calls(tools, calls, config, serial=SESSION_TOOLS)
+
+
+def route_interrupt_tools(state: State):
+    """
+    Use this in conditional edges after `run_tools`, the interrupting calls run
+    in a node of their own, so resuming them does not run the other tools again.
+    """
+    if _tool_calls(state, interrupting=True):
+        return "interrupt_tools"
+    return "chatbot"
+
+
+def run_interrupt_tools(state: State, config: RunnableConfig):
+    """
+    run the calls to tools which interrupt, one at a time in the order the model made them,
+    so that each resume value goes to the same call every time the node is resumed.
+    The state updates of the calls are merged in the same order.
+    """
+    update = {"messages": []}
+    for call in _tool_calls(state, interrupting=True):
+        merge_tool_output(update, tools.invoke([call], config))
+    return update
+
+
+def chatbot(state: State, config: RunnableConfig):
     """
     a simple chatbot function that uses the ChatOllama model to respond to messages.
+
+    With `stream_tools` set in the configurable, the default, the response is streamed
+    and the calls to tools which do not interrupt run as soon as their arguments are
+    complete, their results follow the message in the order of the calls.
     """
-    # create a ChatOllama instance
-    llm = ChatOllama(model='qwen3:8b', reasoning=False)
-    llm = llm.bind_tools(tools=tools_list)
-    message = llm.invoke(state["messages"])
-    # disable parallel tool calls so as to use human_assistance interrupt
-    assert len(message.tool_calls) <= 1
-    return {"messages": [message], }
\ No newline at end of file
+    llm = _get_model("qwen3")
+    if not config.get("configurable", {}).get("stream_tools", True):
+        message = llm.invoke(state["messages"])
+        return {"messages": [message], }
+    message, update = stream_with_tools(
+        llm, state["messages"], tools, config, skip=INTERRUPT_TOOLS, serial=SESSION_TOOLS
+    )
+    return {**update, "messages": [message, *update["messages"]]}
\ No newline at end of file
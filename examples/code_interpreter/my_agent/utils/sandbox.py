@@ -0,0 +1,508 @@
+import os
+import sys
+import ast
+import builtins
+import time
+import uuid
+import queue
+import atexit
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import subprocess
+from collections import OrderedDict
+from importlib import import_module
+from multiprocessing.connection import Client, Connection
+from traceback import format_exc
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import resource
+
+# libraries imported once per worker, so the code does not pay for importing them
+PRELOAD = ("numpy", "math", "fractions", "statistics")
+_NUMPY_FUNCTIONS = (
+    "array", "asarray", "arange", "linspace", "logspace", "zeros", "ones", "full", "eye", "identity",
+    "diag", "reshape", "transpose", "concatenate", "stack", "vstack", "hstack", "tile", "repeat", "flip",
+    "meshgrid", "tril", "triu", "trace", "kron", "einsum", "dot", "vdot", "matmul", "inner", "outer", "cross",
+    "sum", "prod", "cumsum", "cumprod", "mean", "average", "median", "std", "var", "percentile", "quantile",
+    "min", "max", "amin", "amax", "argmin", "argmax", "minimum", "maximum", "ptp", "count_nonzero",
+    "sort", "argsort", "unique", "where", "nonzero", "argwhere", "any", "all", "isclose", "allclose",
+    "array_equal", "isnan", "isinf", "isfinite", "clip", "sign", "abs", "absolute", "sqrt", "cbrt", "square",
+    "power", "exp", "exp2", "expm1", "log", "log2", "log10", "log1p", "sin", "cos", "tan", "arcsin",
+    "arccos", "arctan", "arctan2", "sinh", "cosh", "tanh", "arcsinh", "arccosh", "arctanh", "hypot",
+    "degrees", "radians", "deg2rad", "rad2deg", "floor", "ceil", "trunc", "fix", "rint", "round", "around",
+    "add", "subtract", "multiply", "divide", "true_divide", "floor_divide", "mod", "remainder", "divmod",
+    "gcd", "lcm", "real", "imag", "conj", "angle", "diff", "gradient", "convolve", "interp", "trapz",
+    "trapezoid", "polyfit", "polyval", "poly", "roots", "polyder", "polyint", "histogram", "bincount",
+    "logical_and", "logical_or", "logical_not", "logical_xor", "pi", "e", "inf", "nan", "newaxis",
+    "float64", "float32", "int64", "int32", "complex128", "bool_",
+)
+_SYMPY_NAMES = (
+    "Symbol", "symbols", "Rational", "Integer", "Float", "S", "pi", "E", "I", "oo", "nan", "sqrt", "cbrt",
+    "root", "exp", "log", "ln", "sin", "cos", "tan", "cot", "sec", "csc", "asin", "acos", "atan", "atan2",
+    "sinh", "cosh", "tanh", "Abs", "sign", "floor", "ceiling", "Mod", "Min", "Max", "re", "im", "arg",
+    "conjugate", "factorial", "binomial", "gamma", "beta", "erf", "fibonacci", "harmonic", "Sum", "Product",
+    "summation", "product", "Integral", "integrate", "Derivative", "diff", "Limit", "limit", "series",
+    "Eq", "Ne", "Lt", "Le", "Gt", "Ge", "Function", "Lambda", "Piecewise", "Matrix", "eye", "zeros", "ones",
+    "diag", "solve", "solveset", "linsolve", "nonlinsolve", "nsolve", "dsolve", "simplify", "expand",
+    "factor", "collect", "cancel", "apart", "together", "trigsimp", "nsimplify", "sympify", "N", "Poly",
+    "roots", "real_roots", "nroots", "degree", "gcd", "lcm", "isprime", "prime", "nextprime", "prevprime",
+    "primerange", "primefactors", "factorint", "divisors", "divisor_count", "totient", "mod_inverse",
+    "Interval", "FiniteSet", "Union", "Intersection", "Reals", "Integers", "latex",
+)
+# call paths giving the same output for the same input, a path is allowed if it
+# or one of its parent modules is listed, e.g. `numpy.linalg.det` by `numpy.linalg`
+DETERMINISTIC_PATHS = frozenset({
+    "math", "cmath", "fractions", "decimal", "statistics", "numbers", "itertools", "operator",
+    "heapq", "bisect", "functools.reduce", "functools.partial", "collections.Counter", "collections.deque",
+    "collections.defaultdict", "collections.OrderedDict",
+    "numpy.linalg", "numpy.polynomial", "numpy.fft",
+    "scipy.linalg", "scipy.special", "scipy.integrate", "scipy.optimize", "scipy.interpolate",
+    "scipy.constants", "scipy.fft", "scipy.stats",
+    "sympy.abc", "sympy.core", "sympy.functions", "sympy.ntheory", "sympy.polys", "sympy.matrices",
+    "sympy.simplify", "sympy.solvers", "sympy.series", "sympy.integrals", "sympy.calculus", "sympy.sets",
+    "sympy.concrete", "sympy.combinatorics", "sympy.geometry", "sympy.logic",
+    *(f"numpy.{name}" for name in _NUMPY_FUNCTIONS),
+    *(f"sympy.{name}" for name in _SYMPY_NAMES),
+})
+# builtins computing on their arguments only, exception classes are allowed as well
+DETERMINISTIC_BUILTINS = frozenset({
+    "abs", "all", "any", "bin", "bool", "chr", "complex", "dict", "divmod", "enumerate", "filter", "float",
+    "format", "frozenset", "hex", "int", "isinstance", "issubclass", "len", "list", "map", "max", "min",
+    "oct", "ord", "pow", "print", "range", "reversed", "round", "set", "slice", "sorted", "str", "sum",
+    "tuple", "zip", "True", "False", "None", "NotImplemented", "Ellipsis",
+}) | frozenset(
+    name for name, value in vars(builtins).items() if isinstance(value, type) and issubclass(value, BaseException)
+)
+# names drawing random numbers or reading and writing files, denied also below an
+# allowed path and as methods of values, e.g. `scipy.stats.norm.rvs` or `a.tofile`
+NONDETERMINISTIC_ATTRIBUTES = frozenset({
+    "random", "default_rng", "seed", "rvs", "random_state",
+    "differential_evolution", "basinhopping", "dual_annealing", "shgo",
+    "load", "loads", "save", "savez", "savez_compressed", "loadtxt", "savetxt", "genfromtxt",
+    "fromfile", "tofile", "fromregex", "memmap", "open", "DataSource", "dump", "dumps",
+})
+
+
+def _nondeterministic(name: str) -> bool:
+    # `rand`, `randn`, `randint`, `randprime`, `randMatrix`, ...
+    return (
+        name in NONDETERMINISTIC_ATTRIBUTES
+        or name.lower().startswith("rand")
+        # `__class__`, `__subclasses__`, `__globals__` reach any object
+        or name.startswith("__")
+    )
+
+
+def _allowed(path: str) -> bool:
+    parts = path.split(".")
+    if any(_nondeterministic(part) for part in parts):
+        return False
+    return any(".".join(parts[:i]) in DETERMINISTIC_PATHS for i in range(1, len(parts) + 1))
+
+
+def _importable(path: str) -> bool:
+    """an allowed path, or a module on the way to one, e.g. `numpy` or `scipy`"""
+    return _allowed(path) or any(allowed.startswith(path + ".") for allowed in DETERMINISTIC_PATHS)
+
+
+class SandboxError(Exception):
+    """Raised when the sandboxed code fails, times out or exceeds its memory."""
+
+
+def _chain(node: ast.AST) -> Tuple[Optional[ast.Name], List[str]]:
+    """the name an attribute chain starts with, None if it starts with an expression, and its attributes"""
+    attributes = []
+    while isinstance(node, ast.Attribute):
+        attributes.append(node.attr)
+        node = node.value
+    return (node if isinstance(node, ast.Name) else None), attributes[::-1]
+
+
+def is_deterministic(code: str) -> bool:
+    """
+    whether `code` always gives the same result on its own: every module function
+    it uses is in `DETERMINISTIC_PATHS`, every builtin in `DETERMINISTIC_BUILTINS`,
+    its methods neither draw random numbers nor do I/O, and it reads no variable
+    it does not define itself, e.g. one left by an earlier session call.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return False
+
+    # imported name -> the dotted path it stands for
+    modules: Dict[str, str] = {}
+    defined, loaded = set(), set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if not _importable(alias.name):
+                    return False
+                # `import numpy.linalg` binds `numpy`
+                name = alias.asname or alias.name.split(".")[0]
+                modules[name] = alias.name if alias.asname else name
+        elif isinstance(node, ast.ImportFrom):
+            if not node.module or node.level:
+                return False
+            for alias in node.names:
+                path = f"{node.module}.{alias.name}"
+                if alias.name == "*" or not _importable(path):
+                    return False
+                modules[alias.asname or alias.name] = path
+        elif isinstance(node, ast.Name):
+            (loaded if isinstance(node.ctx, ast.Load) else defined).add(node.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            defined.add(node.name)
+        elif isinstance(node, ast.arg):
+            defined.add(node.arg)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            defined.add(node.name)
+
+    # the outermost attribute chains and names, `np.linalg.det` but not `np.linalg` or `np`
+    inner = {id(node.value) for node in ast.walk(tree) if isinstance(node, ast.Attribute)}
+    for node in ast.walk(tree):
+        if id(node) in inner or not isinstance(node, (ast.Attribute, ast.Name)):
+            continue
+        name, attributes = _chain(node)
+        if name is not None and name.id in modules:
+            if not _allowed(".".join([modules[name.id], *attributes])):
+                return False
+        elif any(_nondeterministic(attribute) for attribute in attributes):
+            # a method of a value
+            return False
+
+    defined |= set(modules)
+    return not (loaded - defined - DETERMINISTIC_BUILTINS)
+
+
+def _execute(code: str, namespace: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
+    if namespace is None:
+        namespace = {}  # a new namespace for each call
+    # a session keeps its namespace, but not the result of the previous call
+    namespace.pop('result', None)
+    try:
+        exec(code, namespace)
+        return True, str(namespace.get('result', 'No variable named `result` found.'))
+    except MemoryError:
+        return False, "MemoryError: the code exceeded the memory limit of the sandbox"
+    except BaseException as e:
+        return False, f"{type(e).__name__}: {e}\nTraceback:\n{format_exc()}"
+
+
+def _run_forked(
+    code: str, timeout: float, memory_limit: Optional[int], inherited: Sequence[Connection]
+) -> Tuple[bool, str]:
+    """run `code` in a forked child, which inherits the preloaded modules and is thrown away"""
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(r)
+        for conn in inherited:
+            conn.close()
+        if memory_limit:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        conn = Connection(w, readable=False)
+        try:
+            conn.send(_execute(code))
+        finally:
+            os._exit(0)
+
+    os.close(w)
+    conn = Connection(r, writable=False)
+    try:
+        if conn.poll(timeout):
+            return conn.recv()
+        os.kill(pid, signal.SIGKILL)
+        return False, f"TimeoutError: the code did not finish within {timeout} seconds"
+    except EOFError:
+        return False, "the code exited or crashed before setting `result`"
+    finally:
+        conn.close()
+        os.waitpid(pid, 0)
+
+
+def _start_session(path: str, memory_limit: Optional[int], inherited: Sequence[Connection]) -> int:
+    """
+    fork a child which keeps one namespace and serves the pool directly
+    on the unix socket at `path`, return its pid.
+    """
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+    pid = os.fork()
+    if pid != 0:
+        listener.close()
+        return pid
+
+    try:
+        for conn in inherited:
+            conn.close()
+        if memory_limit:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        # give up if the pool never connects
+        listener.settimeout(30)
+        sock, _ = listener.accept()
+        listener.close()
+        os.unlink(path)
+        conn = Connection(sock.detach())
+        namespace = {}
+        while True:
+            try:
+                code = conn.recv()
+            except EOFError:
+                break
+            conn.send(_execute(code, namespace))
+    finally:
+        os._exit(0)
+
+
+def _reap() -> None:
+    """collect the exit status of closed sessions"""
+    while True:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+
+
+def _serve() -> None:
+    """the worker loop, reads `("run", ...)` and `("session", ...)` requests from stdin"""
+    for name in PRELOAD:
+        try:
+            import_module(name)
+        except ImportError:
+            pass
+    # keep the protocol on its own descriptor, printing from the code goes to stderr
+    requests = Connection(os.dup(0), writable=False)
+    responses = Connection(os.dup(1), readable=False)
+    os.dup2(2, 1)
+
+    inherited = (requests, responses)
+    while True:
+        try:
+            op, *args = requests.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        _reap()
+        if op == "run":
+            responses.send(_run_forked(*args, inherited))
+        elif op == "session":
+            responses.send(_start_session(*args, inherited))
+
+
+class _Worker:
+    def __init__(self) -> None:
+        # a fixed hash seed, so that e.g. printing a set of strings gives the same result in every worker
+        env = dict(os.environ, OPENBLAS_NUM_THREADS="1", OMP_NUM_THREADS="1", PYTHONHASHSEED="0")
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env,
+        )
+        self.requests = Connection(self.process.stdin.fileno(), readable=False)
+        self.responses = Connection(self.process.stdout.fileno(), writable=False)
+
+    def request(self, message: Tuple[Any, ...], timeout: float) -> Any:
+        self.requests.send(message)
+        if not self.responses.poll(timeout):
+            raise TimeoutError(f"the sandbox worker did not answer within {timeout} seconds")
+        return self.responses.recv()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+
+class _Session:
+    def __init__(self, conn: Connection, pid: int) -> None:
+        self.conn = conn
+        self.pid = pid
+        # tells a session apart from an earlier one of the same id, which was reset
+        self.generation = uuid.uuid4().hex
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    def close(self) -> None:
+        self.conn.close()
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class SandboxPool:
+    """
+    A pool of warm worker processes executing untrusted code.
+
+    Each worker is started ahead of time with the `PRELOAD` libraries imported,
+    and runs every call in a forked child with a wall-clock timeout and an
+    address-space limit. The child is discarded after the call, so state left
+    behind by one call never leaks into the next, while the cost per call stays
+    at a fork instead of an interpreter start. A worker which stops responding
+    is killed and replaced. Requires a POSIX system for `fork` and `setrlimit`.
+
+    Calls with a `session` id run in a session instead: a child forked once per
+    id, which keeps its variables and imports across calls and has the same
+    memory limit. Sessions idle for `idle_timeout` seconds, or beyond the
+    `max_sessions` most recently used, are closed.
+
+    Parameters
+    ----------
+    size : int
+        The number of worker processes, also the number of concurrent calls.
+    timeout : float
+        The default wall-clock timeout of a call in seconds.
+    memory_limit : int, optional
+        The address-space limit of a call or session in bytes.
+    idle_timeout : float
+        Seconds after which an unused session is closed.
+    max_sessions : int
+        The maximum number of open sessions.
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        timeout: float = 30.0,
+        memory_limit: Optional[int] = 1024 ** 3,
+        idle_timeout: float = 600.0,
+        max_sessions: int = 32,
+    ) -> None:
+        self.size = size
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        for _ in range(size):
+            self._idle.put(_Worker())
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._sessions_lock = threading.Lock()
+        self._socket_dir = tempfile.mkdtemp(prefix="sandbox-")
+        atexit.register(shutil.rmtree, self._socket_dir, True)
+
+    def _request(self, message: Tuple[Any, ...], timeout: float) -> Any:
+        worker = self._idle.get()
+        try:
+            response = worker.request(message, timeout)
+        except (TimeoutError, EOFError, OSError) as e:
+            worker.kill()
+            self._idle.put(_Worker())
+            raise SandboxError(str(e) or "the sandbox worker exited")
+        self._idle.put(worker)
+        return response
+
+    def _evict_idle(self) -> None:
+        deadline = time.monotonic() - self.idle_timeout
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_used > deadline and len(self._sessions) <= self.max_sessions:
+                return
+            del self._sessions[session_id]
+            session.close()
+
+    def _session(self, session_id: str) -> _Session:
+        with self._sessions_lock:
+            self._evict_idle()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                self._sessions.move_to_end(session_id)
+                return session
+
+        path = os.path.join(self._socket_dir, f"{uuid.uuid4().hex}.sock")
+        pid = self._request(("session", path, self.memory_limit), 10)
+        session = _Session(Client(path, family="AF_UNIX"), pid)
+        with self._sessions_lock:
+            existing = self._sessions.get(session_id)
+            if existing is not None:
+                # started concurrently by another call of the same session
+                session.close()
+                return existing
+            self._sessions[session_id] = session
+            self._evict_idle()
+        return session
+
+    def session_generation(self, session_id: str) -> Optional[str]:
+        """
+        the generation of the open session with this id, None if there is none.
+        Counts as a use of the session, so it is not closed for being idle right after.
+        """
+        with self._sessions_lock:
+            self._evict_idle()
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session.generation
+
+    def close_session(self, session_id: str) -> None:
+        """close a session, its next call starts with an empty namespace"""
+        with self._sessions_lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+
+    def _run_session(self, code: str, timeout: float, session_id: str) -> Tuple[bool, str]:
+        session = self._session(session_id)
+        with session.lock:
+            try:
+                session.conn.send(code)
+                if not session.conn.poll(timeout):
+                    raise TimeoutError(
+                        f"the code did not finish within {timeout} seconds, the session was reset"
+                    )
+                response = session.conn.recv()
+            except (TimeoutError, EOFError, OSError) as e:
+                self.close_session(session_id)
+                raise SandboxError(str(e) or "the session exited and was reset")
+            session.last_used = time.monotonic()
+        return response
+
+    def run(self, code: str, timeout: Optional[float] = None, session: Optional[str] = None) -> str:
+        """
+        execute `code` in a worker and return `str(result)`.
+
+        Parameters
+        ----------
+        code : str
+            The Python code to execute, the output is read from its `result` variable.
+        timeout : float, optional
+            The wall-clock timeout in seconds, `self.timeout` by default.
+        session : str, optional
+            Run in the session with this id, created on first use, instead of
+            a fresh namespace.
+        """
+        timeout = timeout or self.timeout
+        if session is not None:
+            ok, output = self._run_session(code, timeout, session)
+        else:
+            # the worker enforces the timeout, the extra seconds only catch a stuck worker
+            ok, output = self._request(("run", code, timeout, self.memory_limit), timeout + 5)
+        if not ok:
+            raise SandboxError(output)
+        return output
+
+
+_sandbox: Optional[SandboxPool] = None
+_sandbox_lock = threading.Lock()
+
+
+def get_sandbox() -> SandboxPool:
+    """the process-wide sandbox pool, created on first use"""
+    global _sandbox
+    # concurrent tool calls must not start a pool each
+    with _sandbox_lock:
+        if _sandbox is None:
+            _sandbox = SandboxPool()
+        return _sandbox
+
+
+if __name__ == "__main__":
+    _serve()
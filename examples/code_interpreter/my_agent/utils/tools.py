@@ -1,11 +1,15 @@
 from pydantic import BaseModel, Field
-from typing import Type, Any, Dict
+from typing import Type, Any, Dict, Optional
 from traceback import format_exc
 
 from langchain_core.tools import BaseTool, ToolException
+from langchain_core.runnables import RunnableConfig
 from langgraph.types import Command, interrupt
 from langchain_core.tools import tool
 
+from .cache import ResultCache
+from .sandbox import get_sandbox
+
 @tool
 def human_assistance(query: str) -> str:
     """
@@ -33,16 +37,34 @@ class CodeInterpreter(BaseTool):
     description: str = (
         "A code interpreter function to execute Python code and return the result."
         "You can use code_interpreter to do calculations to answer the question more accurately."
+        "Variables and imports defined by earlier calls in the same conversation are kept, reuse them."
     )
     args_schema: Type[BaseModel] = CodeInterpreterInput
     handle_tool_error: bool = True
+    timeout: float = 30.0
+    # keep one interpreter session per graph thread
+    sessions: bool = True
+    # opt-in cache of deterministic results, e.g. `CodeInterpreter(cache=ResultCache())`
+    cache: Optional[ResultCache] = None
     
     def __init__(self, **kwargs: Any) -> None:
         super().__init__(**kwargs)
 
-    def _run(self, code: str) -> Dict[str, Any]:
+    def _run(self, code: str, config: RunnableConfig) -> Dict[str, Any]:
+        thread_id = config.get("configurable", {}).get("thread_id")
+        session = str(thread_id) if self.sessions and thread_id is not None else None
+        # a cached call is not run, the variables it defines must still be in the session:
+        # the key holds the session generation, which changes when the session is reset
+        generation = get_sandbox().session_generation(session) if session is not None else None
+        key = None
+        if self.cache is not None and (session is None or generation is not None):
+            key = self.cache.key(code, f"{session}:{generation}" if session is not None else None)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return {"result": cached}
         try:
-            result = code_interpreter(code)
+            result = code_interpreter(code, timeout=self.timeout, session=session)
         except Exception as e:
             error_message = (
                 f"error when executing code: {code}.\n"
@@ -51,20 +73,30 @@ class CodeInterpreter(BaseTool):
             )
             raise ToolException(error_message)
         
+        if self.cache is not None and session is not None and generation is None:
+            # the call started the session
+            generation = get_sandbox().session_generation(session)
+            if generation is not None:
+                key = self.cache.key(code, f"{session}:{generation}")
+        if key is not None:
+            self.cache.put(key, result)
         return {"result": result}
     
 
-def code_interpreter(code: str) -> str:
+def code_interpreter(code: str, timeout: Optional[float] = None, session: Optional[str] = None) -> str:
     """
-    executes the provided Python code and returns the result.
+    executes the provided Python code in a sandbox worker process and returns the result.
 
     Parameters
     ----------
     code : str
         The Python code to execute. It should define a variable named `result` which 
         contains all the output you needed. Make sure `result` is an object that can be converted to a string.
+    timeout : float, optional
+        The wall-clock timeout in seconds, the sandbox default if None.
+    session : str, optional
+        The interpreter session to run in, its variables and imports are kept between calls.
+        A fresh namespace is used if None.
     """
-    namespace = {} # Create a new namespace for code execution
-    exec(code, namespace) # Execute the code in the isolated namespace
-    # Return the result from the executed code
-    return str(namespace.get('result', 'No variable named `result` found.'))
\ No newline at end of file
+    # runs in a pre-forked worker, with a time and memory limit
+    return get_sandbox().run(code, timeout=timeout, session=session)
@@ -0,0 +1,51 @@
+import pytest
+
+from my_agent.utils.sandbox import is_deterministic
+
+
+@pytest.mark.parametrize("code", [
+    "from numpy.random import rand; result = rand()",
+    "from numpy import random as r; result = r.rand()",
+    "from numpy import random; result = random.rand()",
+    "import numpy.random; result = numpy.random.rand()",
+    "import scipy.stats as s; result = s.norm.rvs()",
+    "import numpy; result = numpy.load('f.npy')",
+    "from numpy import load; result = load('f.npy')",
+    "import numpy as np; result = np.loadtxt('f.txt')",
+    "import numpy as np; result = np.fromfile('f.bin')",
+    "import numpy as np; np.save('f.npy', np.ones(3)); result = 1",
+    "import sympy; result = sympy.randprime(1, 100)",
+    "from numpy import *; result = rand()",
+    "from . import x; result = x",
+    "import numpy as np; result = getattr(np, 'ran' + 'dom').rand()",
+    "result = open('f.txt').read()",
+    "import time; result = time.time()",
+    "import numpy as np; result = np.datetime64('now')",
+    "import numpy as np; result = np.empty(5)",
+    "result = str(object())",
+    "from scipy import io; result = io.loadmat('f.mat')",
+    "import numpy as np; result = np.lib.format.open_memmap('f.npy')",
+    "import numpy as np; result = np.fromstring('1 2', sep=' ')",
+    "import numpy as np; np.arange(3).tofile('f.bin'); result = 1",
+    "result = ().__class__.__base__.__subclasses__()",
+    "import numpy as np; m = np; result = m.empty(3)",
+    "import os; result = os.getpid()",
+])
+def test_random_and_io_are_not_deterministic(code):
+    assert not is_deterministic(code)
+
+
+@pytest.mark.parametrize("code", [
+    "import numpy as np; result = np.linalg.eigvals(np.array([[1, 2], [3, 4]])).max()",
+    "from numpy import linalg; result = linalg.det([[1, 2], [3, 4]])",
+    "import scipy.stats as s; result = s.norm.cdf(1.0)",
+    "from fractions import Fraction; result = Fraction(1, 3) + Fraction(1, 6)",
+    "result = sum(range(10))",
+    "import sympy as sp; x = sp.symbols('x'); result = sp.solve(x**2 - 4, x)",
+    "from sympy import Rational, sqrt; result = sqrt(Rational(9, 4))",
+    "import math; result = math.comb(10, 3)",
+    "import numpy as np; a = np.array([[2, 0], [0, 3]]); result = a.sum() + np.trace(a)",
+    "from scipy.optimize import brentq; result = brentq(lambda x: x**2 - 2, 0, 2)",
+])
+def test_pure_computations_are_deterministic(code):
+    assert is_deterministic(code)
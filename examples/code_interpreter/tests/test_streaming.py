@@ -0,0 +1,65 @@
+import json
+
+import pytest
+from langchain_core.messages import AIMessageChunk, HumanMessage, ToolMessage
+from langgraph.graph import END, START, StateGraph
+
+from my_agent.utils.nodes import SESSION_TOOLS, tools
+from my_agent.utils.state import State
+from my_agent.utils.sandbox import get_sandbox
+from my_agent.utils.streaming import run_tool_calls, stream_with_tools
+
+# the first call is slow, the second one reads the variable it defines
+CODES = ["import time; time.sleep(0.2); x = 6 * 7; result = x", "result = x + 1"]
+
+
+class StreamingToolModel:
+    """streams one message calling the code interpreter once per code, one chunk per call"""
+
+    def __init__(self, codes):
+        self.codes = codes
+
+    def stream(self, messages):
+        for i, code in enumerate(self.codes):
+            yield AIMessageChunk(content="", tool_call_chunks=[{
+                "name": "code_interpreter", "args": json.dumps({"code": code}), "id": f"c{i}", "index": i,
+            }])
+
+
+@pytest.fixture
+def config(request):
+    thread_id = f"test-{request.node.name}"
+    yield {"configurable": {"thread_id": thread_id}}
+    get_sandbox().close_session(thread_id)
+
+
+def run_node(node, config):
+    """the tool messages added by a graph of the single `node`"""
+    builder = StateGraph(State)
+    builder.add_node("node", node)
+    builder.add_edge(START, "node")
+    builder.add_edge("node", END)
+    result = builder.compile().invoke({"messages": [HumanMessage("compute")]}, config)
+    return [m for m in result["messages"] if isinstance(m, ToolMessage)]
+
+
+@pytest.mark.parametrize("attempt", range(3))
+def test_streamed_calls_on_one_session_run_in_order(config, attempt):
+    def node(state, config):
+        message, update = stream_with_tools(StreamingToolModel(CODES), [], tools, config, serial=SESSION_TOOLS)
+        return {"messages": [message, *update["messages"]]}
+
+    messages = run_node(node, config)
+    assert [m.tool_call_id for m in messages] == ["c0", "c1"]
+    assert "42" in messages[0].content
+    assert "43" in messages[1].content
+
+
+def test_run_tool_calls_on_one_session_run_in_order(config):
+    calls = [
+        {"name": "code_interpreter", "args": {"code": code}, "id": f"c{i}", "type": "tool_call"}
+        for i, code in enumerate(CODES)
+    ]
+    messages = run_node(lambda state, config: run_tool_calls(tools, calls, config, serial=SESSION_TOOLS), config)
+    assert [m.tool_call_id for m in messages] == ["c0", "c1"]
+    assert "43" in messages[1].content
@@ -0,0 +1,139 @@
+"""
+HTTP API to review the threads paused by `human_decision`: list the pending
+interrupts, inspect their payloads and resume them, one at a time or in bulk.
+
+Run from the example directory:
+
+    uvicorn my_agent.api:app --port 8002
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException, Query
+from pydantic import BaseModel
+
+from my_agent.agent import builder
+from my_agent.utils.interrupts import InterruptIndexSaver, ResumeError, resume_thread
+
+# resumed threads run the graph again, this bounds the runs of a bulk resume
+MAX_CONCURRENCY = int(os.getenv("REVIEW_MAX_CONCURRENCY", "8"))
+
+checkpointer = InterruptIndexSaver()
+graph = builder.compile(checkpointer=checkpointer)
+app = FastAPI(title="Interrupt review")
+
+
+class RunRequest(BaseModel):
+    input: Dict[str, Any]
+
+
+class ResumeRequest(BaseModel):
+    resume: Any
+    # required if the thread waits on several interrupts
+    interrupt_id: Optional[str] = None
+
+
+class BulkResumeItem(ResumeRequest):
+    thread_id: str
+
+
+class BulkResumeRequest(BaseModel):
+    items: List[BulkResumeItem]
+
+
+def _config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+@app.post("/threads/{thread_id}/runs")
+def run_thread(thread_id: str, request: RunRequest):
+    """
+    Run the graph on a thread until it finishes or waits on an interrupt
+
+    Args:
+        thread_id: str
+            The thread to run
+        request: RunRequest
+            The graph input, e.g. `{}`
+    """
+    graph.invoke(request.input, _config(thread_id))
+    return {"thread_id": thread_id, "interrupts": [p.to_dict() for p in checkpointer.index.thread(thread_id)]}
+
+
+@app.get("/interrupts")
+def list_interrupts(cursor: int = 0, limit: int = Query(100, ge=1, le=1000)):
+    """
+    List the pending interrupts of all threads, oldest first, served from the index
+
+    Args:
+        cursor: int
+            The `next_cursor` of the previous page, the first page if 0
+        limit: int
+            The maximum number of interrupts in the page
+    """
+    page = checkpointer.index.page(after=cursor, limit=limit)
+    return {
+        "interrupts": [p.to_dict() for p in page],
+        "next_cursor": page[-1].seq if len(page) == limit else None,
+        "pending": len(checkpointer.index),
+        "threads": checkpointer.index.threads(),
+    }
+
+
+@app.get("/threads/{thread_id}/interrupts")
+def get_thread_interrupts(thread_id: str):
+    """
+    Inspect the interrupts a thread waits on, with their payloads
+
+    Args:
+        thread_id: str
+            The thread to inspect
+    """
+    pending = checkpointer.index.thread(thread_id)
+    if not pending:
+        raise HTTPException(status_code=404, detail=f"thread {thread_id} is not waiting on an interrupt")
+    return {"thread_id": thread_id, "interrupts": [p.to_dict() for p in pending]}
+
+
+@app.post("/threads/{thread_id}/resume")
+def resume(thread_id: str, request: ResumeRequest):
+    """
+    Resume a thread with `Command(resume=...)`
+
+    Args:
+        thread_id: str
+            The thread to resume
+        request: ResumeRequest
+            The value `interrupt()` returns, "approve" or anything else to reject
+
+    Returns the interrupts the thread waits on afterwards, 409 if it was not waiting.
+    """
+    try:
+        pending = resume_thread(graph, thread_id, request.resume, request.interrupt_id)
+    except ResumeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"thread_id": thread_id, "interrupts": [p.to_dict() for p in pending]}
+
+
+@app.post("/interrupts/resume")
+def resume_bulk(request: BulkResumeRequest):
+    """
+    Resume several threads concurrently, each item reports its own outcome
+
+    Args:
+        request: BulkResumeRequest
+            The threads to resume and their resume values
+    """
+    def resume_item(item: BulkResumeItem) -> Dict[str, Any]:
+        try:
+            pending = resume_thread(graph, item.thread_id, item.resume, item.interrupt_id)
+        except ResumeError as e:
+            return {"thread_id": item.thread_id, "status": "conflict", "detail": str(e)}
+        except Exception as e:
+            return {"thread_id": item.thread_id, "status": "error", "detail": str(e)}
+        return {"thread_id": item.thread_id, "status": "resumed", "interrupts": [p.to_dict() for p in pending]}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(MAX_CONCURRENCY, len(request.items)))) as executor:
+        results = list(executor.map(resume_item, request.items))
+    return {"results": results}
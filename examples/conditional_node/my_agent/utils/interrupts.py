@@ -0,0 +1,225 @@
+"""
+An index of the interrupts that threads are waiting on, kept up to date from the
+checkpointer writes, so pending interrupts are listed without reading checkpoints.
+
+The graph saves an `__interrupt__` write when a task calls `interrupt()`. The task
+stops waiting once it saves its other writes, and every pending interrupt of a
+namespace is resolved once a newer checkpoint of it is saved.
+"""
+import time
+import threading
+import itertools
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.types import Command
+
+INTERRUPT = "__interrupt__"
+# writes that do not end a task
+_PENDING_CHANNELS = {INTERRUPT, "__resume__", "__error__"}
+
+
+class ResumeError(Exception):
+    """The thread cannot be resumed as requested, e.g. it is not waiting on an interrupt."""
+
+
+@dataclass
+class PendingInterrupt:
+    """An interrupt a thread is waiting on, `seq` orders the interrupts by creation."""
+
+    seq: int
+    thread_id: str
+    interrupt_id: str
+    value: Any
+    checkpoint_ns: str
+    checkpoint_id: str
+    task_id: str
+    created_at: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class InterruptIndex:
+    """
+    The pending interrupts of all threads, in the order they were raised.
+
+    Listing a page costs O(log n + limit) and looking up a thread costs
+    O(its interrupts), independent of the number of checkpoints.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._seqs = itertools.count(1)
+        self._entries: Dict[int, PendingInterrupt] = {}
+        # the keys of `_entries` in ascending order, for paging
+        self._order: List[int] = []
+        # thread_id -> (checkpoint_ns, task_id) -> seqs of the task's interrupts
+        self._threads: Dict[str, Dict[Tuple[str, str], List[int]]] = {}
+        # threads being resumed, see `claim`
+        self._claimed: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _drop(self, thread_id: str, key: Tuple[str, str]) -> None:
+        tasks = self._threads[thread_id]
+        for seq in tasks.pop(key):
+            del self._entries[seq]
+            del self._order[bisect_left(self._order, seq)]
+        if not tasks:
+            del self._threads[thread_id]
+
+    def add(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str, task_id: str,
+            interrupts: Sequence[Any]) -> None:
+        """record the interrupts raised by a task, replacing its earlier ones"""
+        now = time.time()
+        with self._lock:
+            key = (checkpoint_ns, task_id)
+            if key in self._threads.get(thread_id, {}):
+                self._drop(thread_id, key)
+            seqs = []
+            for interrupt in interrupts:
+                seq = next(self._seqs)
+                self._entries[seq] = PendingInterrupt(
+                    seq, thread_id, interrupt.id, interrupt.value, checkpoint_ns, checkpoint_id, task_id, now
+                )
+                self._order.append(seq)
+                seqs.append(seq)
+            self._threads.setdefault(thread_id, {})[key] = seqs
+
+    def complete(self, thread_id: str, checkpoint_ns: str, task_id: str) -> None:
+        """a task finished, it no longer waits"""
+        with self._lock:
+            if (checkpoint_ns, task_id) in self._threads.get(thread_id, {}):
+                self._drop(thread_id, (checkpoint_ns, task_id))
+
+    def advance(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> None:
+        """a newer checkpoint was saved, the interrupts of earlier ones are resolved"""
+        with self._lock:
+            for key, seqs in list(self._threads.get(thread_id, {}).items()):
+                if key[0] == checkpoint_ns and self._entries[seqs[0]].checkpoint_id != checkpoint_id:
+                    self._drop(thread_id, key)
+
+    def forget(self, thread_id: str) -> None:
+        with self._lock:
+            for key in list(self._threads.get(thread_id, {})):
+                self._drop(thread_id, key)
+
+    def page(self, after: int = 0, limit: int = 100) -> List[PendingInterrupt]:
+        """the pending interrupts raised after the one with seq `after`, oldest first"""
+        with self._lock:
+            start = bisect_right(self._order, after)
+            return [self._entries[seq] for seq in self._order[start:start + limit]]
+
+    def thread(self, thread_id: str) -> List[PendingInterrupt]:
+        with self._lock:
+            seqs = [seq for seqs in self._threads.get(thread_id, {}).values() for seq in seqs]
+            return [self._entries[seq] for seq in sorted(seqs)]
+
+    def threads(self) -> int:
+        """the number of threads waiting on an interrupt"""
+        return len(self._threads)
+
+    @contextmanager
+    def claim(self, thread_id: str) -> Iterator[None]:
+        """hold a thread while it is resumed, a concurrent claim raises `ResumeError`"""
+        with self._lock:
+            if thread_id in self._claimed:
+                raise ResumeError(f"thread {thread_id} is already being resumed")
+            self._claimed.add(thread_id)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._claimed.discard(thread_id)
+
+
+class InterruptIndexSaver(InMemorySaver):
+    """An InMemorySaver keeping an `InterruptIndex` of the interrupts its threads wait on."""
+
+    def __init__(self, *, index: Optional[InterruptIndex] = None, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.index = index if index is not None else InterruptIndex()
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        self.index.advance(
+            config["configurable"]["thread_id"], config["configurable"].get("checkpoint_ns", ""), checkpoint["id"]
+        )
+        return next_config
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        super().put_writes(config, writes, task_id, task_path)
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        interrupts = [interrupt for channel, value in writes if channel == INTERRUPT for interrupt in value]
+        if interrupts:
+            self.index.add(thread_id, checkpoint_ns, config["configurable"]["checkpoint_id"], task_id, interrupts)
+        elif any(channel not in _PENDING_CHANNELS for channel, _ in writes):
+            self.index.complete(thread_id, checkpoint_ns, task_id)
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        self.index.forget(thread_id)
+
+
+def _check_pending(index: InterruptIndex, thread_id: str, interrupt_id: Optional[str]) -> List[PendingInterrupt]:
+    """the interrupts the thread waits on, raises `ResumeError` if `interrupt_id` cannot be resumed"""
+    pending = index.thread(thread_id)
+    if not pending:
+        raise ResumeError(f"thread {thread_id} is not waiting on an interrupt")
+    if interrupt_id is None and len(pending) > 1:
+        raise ResumeError(f"thread {thread_id} waits on {len(pending)} interrupts, pass an interrupt_id")
+    if interrupt_id is not None and all(p.interrupt_id != interrupt_id for p in pending):
+        raise ResumeError(f"interrupt {interrupt_id} of thread {thread_id} is not pending")
+    return pending
+
+
+def resume_thread(graph: Any, thread_id: str, resume: Any, interrupt_id: Optional[str] = None) -> List[PendingInterrupt]:
+    """
+    resume a thread waiting on an interrupt with `Command(resume=...)`.
+
+    Parameters
+    ----------
+    graph : CompiledStateGraph
+        A graph compiled with an `InterruptIndexSaver`.
+    thread_id : str
+        The thread to resume.
+    resume : Any
+        The value returned by `interrupt()`.
+    interrupt_id : str, optional
+        The interrupt to resume, required if the thread waits on several.
+
+    Returns
+    -------
+    List[PendingInterrupt]
+        The interrupts the thread waits on afterwards, empty if it finished.
+    """
+    index: InterruptIndex = graph.checkpointer.index
+    pending = _check_pending(index, thread_id, interrupt_id)
+
+    with index.claim(thread_id):
+        # a resume which held the claim since may have answered these interrupts
+        if [p.seq for p in _check_pending(index, thread_id, interrupt_id)] != [p.seq for p in pending]:
+            raise ResumeError(f"the interrupts of thread {thread_id} changed while it was resumed")
+        command = Command(resume={interrupt_id: resume} if interrupt_id is not None else resume)
+        graph.invoke(command, {"configurable": {"thread_id": thread_id}})
+    return index.thread(thread_id)
@@ -2,14 +2,15 @@ from langgraph.graph import StateGraph, START, END
 from langgraph.types import Command
 from langgraph.checkpoint.memory import InMemorySaver
 from my_agent.utils.state import State
-from my_agent.utils.nodes import chatbot, tools, route_tools
+from my_agent.utils.nodes import chatbot, run_tools, run_interrupt_tools, route_tools, route_interrupt_tools
 
 # build a graph
 builder = StateGraph(State)
 
 # add nodes
 builder.add_node("chatbot", chatbot)
-builder.add_node("tools", tools)
+builder.add_node("tools", run_tools)
+builder.add_node("interrupt_tools", run_interrupt_tools)
 
 # set the graph edges
 builder.set_entry_point("chatbot")
@@ -21,8 +22,16 @@ builder.add_conditional_edges(
         END: END
     }
 )
-# when tools are called, go back to the chatbot
-builder.add_edge("tools", "chatbot")
+# when tools are called, run the interrupting ones, then go back to the chatbot
+builder.add_conditional_edges(
+    "tools",
+    route_interrupt_tools,
+    {
+        "interrupt_tools": "interrupt_tools",
+        "chatbot": "chatbot"
+    }
+)
+builder.add_edge("interrupt_tools", "chatbot")
 
 # compile the graph
 graph = builder.compile(checkpointer=None)
@@ -0,0 +1,259 @@
+"""
+Evaluate the math_answer graph on a JSONL dataset, many questions at a time.
+
+Each line of the dataset holds a question and its reference answer:
+
+    {"id": "q1", "question": "矩阵 [[1, 2], [3, 4]] 最大特征值是多少？", "answer": "5.3723"}
+
+Every question runs on its own graph thread. The `evaluate_answer` interrupts
+are resolved against the reference answer, and the first submitted answer is
+scored. Finished questions are appended to a progress file, a killed run
+started again with the same progress file skips them. The report holds the
+throughput and the accuracy.
+
+Run from the example directory:
+
+    python -m my_agent.evaluate questions.jsonl --concurrency 8 --output report.json
+"""
+import re
+import sys
+import json
+import math
+import time
+import argparse
+from typing import Any, Dict, Iterable, List, Optional
+
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.runnables import RunnableLambda
+from langgraph.types import Command
+
+from my_agent.agent import builder
+from my_agent.utils.nodes import tools_list
+from my_agent.utils.cache import ResultCache
+from my_agent.utils.interrupts import InterruptIndexSaver
+from my_agent.utils.sandbox import get_sandbox
+
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?(?:/\d+)?")
+_IGNORED = re.compile(r"[\s$\\{}]|[。.]$")
+
+
+def _number(text: str) -> Optional[float]:
+    try:
+        if "/" in text:
+            numerator, denominator = text.split("/")
+            return float(numerator) / float(denominator)
+        return float(text)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def answers_match(prediction: Optional[str], reference: str, rel_tol: float = 1e-4) -> bool:
+    """
+    compare an answer with the reference, numerically if the reference is a
+    number, then the last number in the answer counts, otherwise as text
+    with whitespace, `$` and a final period ignored.
+    """
+    if prediction is None:
+        return False
+    expected = _number(reference.strip())
+    if expected is not None:
+        numbers = _NUMBER.findall(prediction.replace(",", ""))
+        value = _number(numbers[-1]) if numbers else None
+        return value is not None and math.isclose(value, expected, rel_tol=rel_tol, abs_tol=1e-9)
+    return _IGNORED.sub("", prediction).lower() == _IGNORED.sub("", reference).lower()
+
+
+def load_dataset(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    for index, row in enumerate(rows):
+        row["id"] = str(row.get("id", index))
+    return rows
+
+
+def load_progress(path: str) -> Dict[str, Dict[str, Any]]:
+    """the finished questions by id, a line cut off by a killed run is ignored"""
+    done = {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                done[record["id"]] = record
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(round(q * (len(values) - 1))))], 3)
+
+
+class Evaluator:
+    """
+    Runs questions through the graph and resolves their interrupts.
+
+    Parameters
+    ----------
+    graph : CompiledStateGraph
+        The math_answer graph, compiled with a checkpointer.
+    max_rounds : int
+        The maximum number of interrupts resolved per question.
+    rel_tol : float
+        The relative tolerance of numeric answers.
+    """
+
+    def __init__(self, graph: Any, max_rounds: int = 5, rel_tol: float = 1e-4) -> None:
+        self.graph = graph
+        self.max_rounds = max_rounds
+        self.rel_tol = rel_tol
+
+    def _resume_value(self, interrupt: Any, reference: str, submitted: List[str]) -> Dict[str, str]:
+        # the reviewer's answer: a wrong submission is corrected with the reference
+        answer = str(interrupt.value.get("answer", ""))
+        submitted.append(answer)
+        if answers_match(answer, reference, self.rel_tol):
+            return {"correct": "y", "correction": ""}
+        return {"correct": "n", "correction": reference}
+
+    def solve(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        """run one question to the end, returns its progress record"""
+        thread_id = f"eval-{row['id']}"
+        config = {"configurable": {"thread_id": thread_id}}
+        start = time.perf_counter()
+        submitted: List[str] = []
+        rounds = 0
+        try:
+            result = self.graph.invoke({"messages": [{"role": "user", "content": row["question"]}]}, config)
+            while result.get("__interrupt__") and rounds < self.max_rounds:
+                rounds += 1
+                interrupts = result["__interrupt__"]
+                values = {i.id: self._resume_value(i, row["answer"], submitted) for i in interrupts}
+                resume = next(iter(values.values())) if len(values) == 1 else values
+                result = self.graph.invoke(Command(resume=resume), config)
+
+            messages = result.get("messages", [])
+            final = next((m.content for m in reversed(messages) if isinstance(m, AIMessage) and m.content), None)
+            # the first submission is scored, later ones have seen the correction
+            prediction = submitted[0] if submitted else final
+            return {
+                "id": row["id"],
+                "prediction": prediction,
+                "reference": row["answer"],
+                "correct": answers_match(prediction, row["answer"], self.rel_tol),
+                "verified": bool(submitted),
+                "finished": not result.get("__interrupt__"),
+                "rounds": rounds,
+                "seconds": round(time.perf_counter() - start, 3),
+            }
+        except Exception as e:
+            return {"id": row["id"], "error": f"{type(e).__name__}: {e}", "seconds": round(time.perf_counter() - start, 3)}
+        finally:
+            self._release(thread_id)
+
+    def _release(self, thread_id: str) -> None:
+        """drop the finished thread, and its interpreter session if it ran code"""
+        state = self.graph.get_state({"configurable": {"thread_id": thread_id}})
+        if any(isinstance(m, ToolMessage) and m.name == "code_interpreter" for m in state.values.get("messages", [])):
+            get_sandbox().close_session(thread_id)
+        self.graph.checkpointer.delete_thread(thread_id)
+
+    def run(self, rows: List[Dict[str, Any]], concurrency: int) -> Iterable[Dict[str, Any]]:
+        """
+        yield the progress records as the questions finish, at most
+        `concurrency` questions run at a time.
+        """
+        if not rows:
+            return
+        # a question takes several graph calls, so the batch is over questions:
+        # a slot is freed as soon as its question finished all its rounds
+        solver = RunnableLambda(self.solve, name="solve")
+        for _, record in solver.batch_as_completed(rows, config={"max_concurrency": concurrency}):
+            yield record
+
+
+def summarize(records: List[Dict[str, Any]], run_records: List[Dict[str, Any]], wall: float) -> Dict[str, Any]:
+    scored = [r for r in records if "error" not in r]
+    correct = sum(r["correct"] for r in scored)
+    latencies = [r["seconds"] for r in run_records if "error" not in r]
+    return {
+        "questions": len(records),
+        "errors": len(records) - len(scored),
+        "correct": correct,
+        "accuracy": round(correct / len(scored), 4) if scored else None,
+        "verified": sum(r["verified"] for r in scored),
+        "unfinished": sum(not r["finished"] for r in scored),
+        "mean_rounds": round(sum(r["rounds"] for r in scored) / len(scored), 3) if scored else None,
+        # this run only, questions finished by earlier runs are not timed again
+        "run": {
+            "questions": len(run_records),
+            "wall_seconds": round(wall, 3),
+            "questions_per_sec": round(len(run_records) / wall, 3) if wall else None,
+            "p50_seconds": percentile(latencies, 0.50),
+            "p95_seconds": percentile(latencies, 0.95),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dataset", help="JSONL file with `question` and `answer`, and optionally `id`")
+    parser.add_argument("--concurrency", type=int, default=8, help="questions running at a time")
+    parser.add_argument("--limit", type=int, help="only evaluate the first questions")
+    parser.add_argument("--progress", help="finished questions, default <dataset>.progress.jsonl")
+    parser.add_argument("--retry-errors", action="store_true", help="run questions which failed before again")
+    parser.add_argument("--max-rounds", type=int, default=5, help="interrupts resolved per question")
+    parser.add_argument("--rel-tol", type=float, default=1e-4, help="relative tolerance of numeric answers")
+    parser.add_argument("--code-cache", action="store_true", help="cache deterministic code interpreter results")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    rows = load_dataset(args.dataset)[:args.limit]
+    progress_path = args.progress or f"{args.dataset}.progress.jsonl"
+    done = load_progress(progress_path)
+    if args.retry_errors:
+        done = {k: v for k, v in done.items() if "error" not in v}
+    pending = [row for row in rows if row["id"] not in done]
+    print(f"{len(rows) - len(pending)} of {len(rows)} questions already done, running {len(pending)}", file=sys.stderr)
+
+    interpreter = next(tool for tool in tools_list if tool.name == "code_interpreter")
+    if args.code_cache and interpreter.cache is None:
+        interpreter.cache = ResultCache()
+    # questions only resume from their newest checkpoint, older ones are dropped as they run
+    evaluator = Evaluator(builder.compile(checkpointer=InterruptIndexSaver(keep_last=1)), args.max_rounds, args.rel_tol)
+
+    run_records = []
+    start = time.perf_counter()
+    with open(progress_path, "a", encoding="utf-8") as progress:
+        for record in evaluator.run(pending, args.concurrency):
+            # flushed per question, a killed run loses at most the running questions
+            progress.write(json.dumps(record, ensure_ascii=False) + "\n")
+            progress.flush()
+            run_records.append(record)
+            done[record["id"]] = record
+            print(f"[{len(run_records)}/{len(pending)}] {record['id']}: "
+                  f"{record.get('error') or ('correct' if record['correct'] else 'wrong')}", file=sys.stderr)
+    wall = time.perf_counter() - start
+
+    ids = {row["id"] for row in rows}
+    report = {
+        "dataset": args.dataset,
+        "config": {"concurrency": args.concurrency, "max_rounds": args.max_rounds, "rel_tol": args.rel_tol},
+        **summarize([r for k, r in done.items() if k in ids], run_records, wall),
+    }
+    if interpreter.cache is not None:
+        report["code_cache"] = interpreter.cache.stats()
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
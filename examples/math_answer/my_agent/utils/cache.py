@@ -0,0 +1,73 @@
+import ast
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .sandbox import is_deterministic
+
+
+class ResultCache:
+    """
+    Caches code interpreter results by a hash of the normalized code.
+
+    The code is normalized by parsing and unparsing it, so comments and
+    formatting do not change the key. Only code which `is_deterministic` is
+    cached, and only successful results. Session calls are keyed by session as
+    well, since a hit skips running the code in that session.
+
+    Parameters
+    ----------
+    max_entries : int
+        The maximum number of results kept.
+    ttl : float
+        Seconds a result stays valid.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600.0) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, code: str, session: Optional[str] = None) -> Optional[str]:
+        """the cache key of `code`, None if its result must not be cached"""
+        if not is_deterministic(code):
+            with self._lock:
+                self.uncacheable += 1
+            return None
+        normalized = ast.unparse(ast.parse(code))
+        return hashlib.sha256(f"{session}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, result: str) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "uncacheable": self.uncacheable,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
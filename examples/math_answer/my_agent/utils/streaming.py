@@ -0,0 +1,162 @@
+"""
+Stream a model response and run its tool calls while it is still generating.
+
+A tool call is dispatched as soon as its arguments parse as a complete JSON
+object, so the tool runs while the model generates the rest of the message.
+The results are merged in the order of the calls in the final message, the
+same order the ToolNode would apply them in. Calls to tools sharing state
+between calls, e.g. an interpreter session, run one at a time in call order.
+"""
+import json
+from concurrent.futures import Future
+from typing import Any, Collection, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, AIMessageChunk, message_chunk_to_message
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.runnables.config import ContextThreadPoolExecutor, get_executor_for_config
+from langgraph.prebuilt import ToolNode
+from langgraph.types import Command
+
+
+def merge_tool_output(update: Dict[str, Any], output: Any) -> None:
+    """merge the output of a ToolNode call into a state update, keeping the message order"""
+    for item in (output if isinstance(output, list) else [output]):
+        item = dict(item.update) if isinstance(item, Command) else dict(item)
+        update["messages"].extend(item.pop("messages", []))
+        update.update(item)
+
+
+def _complete_calls(
+    message: AIMessageChunk, started: Collection[str], skip: Collection[str], serial: Collection[str] = ()
+) -> Iterator[Dict[str, Any]]:
+    """
+    the tool calls of a partial message whose arguments finished streaming,
+    a call to a `serial` tool only once every call before it is complete.
+    """
+    waiting = False
+    for chunk in message.tool_call_chunks:
+        if not chunk.get("id") or not chunk.get("name"):
+            # may still turn out to be a call to a serial tool
+            waiting = True
+            continue
+        if chunk["id"] in started or chunk["name"] in skip:
+            continue
+        in_order = chunk["name"] in serial
+        if in_order and waiting:
+            continue
+        try:
+            args = json.loads(chunk.get("args") or "")
+        except json.JSONDecodeError:
+            args = None
+        if isinstance(args, dict):
+            yield {"name": chunk["name"], "args": args, "id": chunk["id"], "type": "tool_call"}
+        elif in_order:
+            waiting = True
+
+
+class _ToolRunner:
+    """
+    runs tool calls in the executor of the config, the calls to `serial` tools
+    one at a time in the order they were submitted.
+    """
+
+    def __init__(self, tools: ToolNode, config: RunnableConfig, serial: Collection[str]) -> None:
+        self.tools = tools
+        self.config = config
+        self.serial = serial
+        self.futures: Dict[str, Future] = {}
+        self._executor = get_executor_for_config(config)
+        self._pool: Any = None
+        self._serial_executor: Optional[ContextThreadPoolExecutor] = None
+
+    def __enter__(self) -> "_ToolRunner":
+        self._pool = self._executor.__enter__()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self._serial_executor is not None:
+            self._serial_executor.shutdown(wait=True)
+        self._executor.__exit__(*exc_info)
+
+    def submit(self, call: Dict[str, Any]) -> None:
+        pool = self._pool
+        if call["name"] in self.serial:
+            if self._serial_executor is None:
+                self._serial_executor = ContextThreadPoolExecutor(max_workers=1)
+            pool = self._serial_executor
+        self.futures[call["id"]] = pool.submit(self.tools.invoke, [call], self.config)
+
+    def update(self, calls: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+        """the state update of the submitted calls, in the order of `calls`"""
+        update: Dict[str, List[Any]] = {"messages": []}
+        for call in calls:
+            if call["id"] in self.futures:
+                merge_tool_output(update, self.futures[call["id"]].result())
+        return update
+
+
+def run_tool_calls(
+    tools: ToolNode, calls: Sequence[Dict[str, Any]], config: RunnableConfig, serial: Collection[str] = ()
+) -> Dict[str, Any]:
+    """
+    run tool calls concurrently, like `ToolNode.invoke`, except the calls to
+    `serial` tools, which run one at a time in the order of `calls`.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The state update of the calls, with the tool messages in the order of the calls.
+    """
+    with _ToolRunner(tools, config, serial) as runner:
+        for call in calls:
+            runner.submit(call)
+        return runner.update(calls)
+
+
+def stream_with_tools(
+    model: Runnable,
+    messages: Sequence[Any],
+    tools: ToolNode,
+    config: RunnableConfig,
+    skip: Collection[str] = (),
+    serial: Collection[str] = (),
+) -> Tuple[AIMessage, Dict[str, Any]]:
+    """
+    stream the model response, running each tool call once its arguments are complete.
+
+    Parameters
+    ----------
+    model : Runnable
+        The chat model, with the tools bound.
+    messages : Sequence
+        The model input.
+    tools : ToolNode
+        Runs the tool calls.
+    config : RunnableConfig
+        The config of the calling node.
+    skip : Collection[str]
+        Tools left to the graph, e.g. the ones calling `interrupt()`.
+    serial : Collection[str]
+        Tools whose calls depend on the earlier ones, e.g. the ones sharing an
+        interpreter session, they run one at a time in call order.
+
+    Returns
+    -------
+    Tuple[AIMessage, Dict[str, Any]]
+        The model response, and the state update of its tool calls, with the
+        tool messages in the order of the calls.
+    """
+    with _ToolRunner(tools, config, serial) as runner:
+        chunks = None
+        for chunk in model.stream(messages):
+            chunks = chunk if chunks is None else chunks + chunk
+            for call in list(_complete_calls(chunks, runner.futures, skip, serial)):
+                runner.submit(call)
+
+        message = message_chunk_to_message(chunks) if chunks is not None else AIMessage("")
+        # calls without arguments, or whose arguments only parse as a whole
+        for call in message.tool_calls:
+            if call["id"] not in runner.futures and call["name"] not in skip:
+                runner.submit({**call, "type": "tool_call"})
+        update = runner.update(message.tool_calls)
+    return message, update
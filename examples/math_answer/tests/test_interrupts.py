@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+from typing import TypedDict
+
+import pytest
+from langgraph.graph import END, START, StateGraph
+from langgraph.types import interrupt
+
+from my_agent.utils.interrupts import InterruptIndex, InterruptIndexSaver, ResumeError, resume_thread
+
+
+class S(TypedDict):
+    answers: list
+
+
+def ask(name):
+    def node(state):
+        return {"answers": state.get("answers", []) + [(name, interrupt(name))]}
+    return node
+
+
+class RacingIndex(InterruptIndex):
+    """runs `before_claim` once, right before the next claim is taken"""
+
+    before_claim = None
+
+    @contextmanager
+    def claim(self, thread_id):
+        hook, self.before_claim = self.before_claim, None
+        if hook is not None:
+            hook()
+        with super().claim(thread_id):
+            yield
+
+
+@pytest.fixture
+def graph():
+    builder = StateGraph(S)
+    builder.add_node("first", ask("first"))
+    builder.add_node("second", ask("second"))
+    builder.add_edge(START, "first")
+    builder.add_edge("first", "second")
+    builder.add_edge("second", END)
+    return builder.compile(checkpointer=InterruptIndexSaver(index=RacingIndex()))
+
+
+def test_resume_racing_another_resume_is_refused(graph):
+    config = {"configurable": {"thread_id": "t"}}
+    graph.invoke({"answers": []}, config)
+    index = graph.checkpointer.index
+    # a second resume checked the pending interrupt, the first one finishes before it claims the thread
+    index.before_claim = lambda: resume_thread(graph, "t", "from the first resume")
+
+    with pytest.raises(ResumeError):
+        resume_thread(graph, "t", "stale")
+
+    assert graph.get_state(config).values["answers"] == [["first", "from the first resume"]]
+    assert [p.value for p in index.thread("t")] == ["second"]
+
+
+def test_resume_answers_the_pending_interrupt(graph):
+    config = {"configurable": {"thread_id": "t"}}
+    graph.invoke({"answers": []}, config)
+    assert [p.value for p in resume_thread(graph, "t", 1)] == ["second"]
+    assert resume_thread(graph, "t", 2) == []
+    assert graph.get_state(config).values["answers"] == [["first", 1], ["second", 2]]
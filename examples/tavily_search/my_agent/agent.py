@@ -6,7 +6,10 @@ from my_agent.utils.state import AgentState
 
 # Define the config
 class GraphConfig(TypedDict):
-    model_name: Literal["qwen3"]
+    # "qwen3" by default, "auto" routes by turn between qwen3:1.7b and qwen3:8b
+    model_name: Literal["auto", "qwen3", "qwen3-small"]
+    # run tool calls while the model response is still streamed
+    stream_tools: bool
 
 
 # define a new graph
@@ -30,6 +33,8 @@ workflow.add_conditional_edges(
         "continue": "action",
         # Otherwise we finish.
         "end": END,
+        # The tools already ran while streaming, call the model again.
+        "agent": "agent",
     },
 )
 
@@ -1,23 +1,36 @@
 from functools import lru_cache
+from langchain_core.messages import ToolMessage
 from langchain_ollama import ChatOllama
 from my_agent.utils.tools import tools
+from my_agent.utils.router import LARGE, SMALL, ModelRouter
+from my_agent.utils.streaming import stream_with_tools
 from langgraph.prebuilt import ToolNode
 
+MODELS = {"qwen3": "qwen3:8b", "qwen3-small": "qwen3:1.7b"}
+
 
 @lru_cache(maxsize=4)
 def _get_model(model_name: str):
-    if model_name == "qwen3":
-        model = ChatOllama(model="qwen3:8b", reasoning=False)
+    if model_name in MODELS:
+        model = ChatOllama(model=MODELS[model_name], reasoning=False)
     else:
         raise ValueError(f"Unsupported model type: {model_name}")
 
     model = model.bind_tools(tools)
     return model
 
+
+# model_name "auto" routes simple turns to the small model and hard ones to the large one,
+# it needs both pulled, a missing small model sends every turn to the large one
+router = ModelRouter(_get_model, {SMALL: "qwen3-small", LARGE: "qwen3"})
+
 # Define the function that determines whether to continue or not
 def should_continue(state):
     messages = state["messages"]
     last_message = messages[-1]
+    # The tools already ran while the model response was streamed
+    if isinstance(last_message, ToolMessage):
+        return "agent"
     # If there are no tool calls, then we finish
     if not last_message.tool_calls:
         return "end"
@@ -33,10 +46,28 @@ def call_model(state, config):
     messages = state["messages"]
     messages = [{"role": "system", "content": system_prompt}] + messages # append system prompt
     model_name = config.get('configurable', {}).get("model_name", "qwen3")
-    model = _get_model(model_name)
-    response = model.invoke(messages)
-    # We return a list, because this will get added to the existing list
-    return {"messages": [response]}
+    if not config.get('configurable', {}).get("stream_tools", True):
+        if model_name == "auto":
+            response = router.invoke(messages, state["messages"])
+            return {"messages": [response], "model_routes": router.stats()}
+        response = _get_model(model_name).invoke(messages)
+        # We return a list, because this will get added to the existing list
+        return {"messages": [response]}
+
+    # run the searches as soon as their arguments are complete, while the model still generates
+    tool_messages = []
+
+    def call(model, messages):
+        response, update = stream_with_tools(model, messages, tool_node, config)
+        # a failed attempt retried on another route leaves no results behind
+        tool_messages[:] = update["messages"]
+        return response
+
+    if model_name == "auto":
+        response = router.invoke(messages, state["messages"], call)
+        return {"messages": [response, *tool_messages], "model_routes": router.stats()}
+    response = call(_get_model(model_name), messages)
+    return {"messages": [response, *tool_messages]}
 
 # Define the function to execute tools
 tool_node = ToolNode(tools)
\ No newline at end of file
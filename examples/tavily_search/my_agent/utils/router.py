@@ -0,0 +1,215 @@
+import re
+import time
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Sequence, Set
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+SMALL = "small"
+LARGE = "large"
+
+# words asking for reasoning rather than a lookup
+_HARD_WORDS = re.compile(
+    r"\b(why|how come|explain|compare|comparison|versus|vs\.?|analy[sz]e|evaluate|prove|derive|"
+    r"step[- ]by[- ]step|pros and cons|trade-?offs?|implications?|recommend|plan|strategy|summari[sz]e)\b"
+    r"|为什么|比较|对比|分析|解释|证明|推导|评估|总结|建议",
+    re.IGNORECASE,
+)
+
+
+def _text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, str):
+        return content
+    return " ".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+
+
+def classify(messages: Sequence[BaseMessage], max_words: int = 40, max_tool_rounds: int = 2) -> str:
+    """
+    route a turn by cheap heuristics on its latest user message, `LARGE` for
+    long or multi-part questions, questions asking for reasoning or holding
+    code, and turns the small model keeps calling tools in.
+    """
+    turn = len(messages)
+    while turn > 0 and not isinstance(messages[turn - 1], HumanMessage):
+        turn -= 1
+    if turn == 0:
+        return SMALL
+    question = _text(messages[turn - 1])
+    tool_rounds = sum(isinstance(m, AIMessage) and bool(m.tool_calls) for m in messages[turn:])
+    if (
+        len(question.split()) > max_words
+        # CJK text has no spaces, count its characters instead
+        or len(question) > max_words * 4
+        or question.count("?") + question.count("？") > 1
+        or "```" in question
+        or _HARD_WORDS.search(question)
+        or tool_rounds >= max_tool_rounds
+    ):
+        return LARGE
+    return SMALL
+
+
+def model_missing(error: BaseException) -> bool:
+    """whether a call failed because the model is not pulled, e.g. Ollama's 404"""
+    return getattr(error, "status_code", None) == 404
+
+
+class RouteStats:
+    """Calls, failures and the recent latencies of a route."""
+
+    def __init__(self, window: int = 256) -> None:
+        self.calls = 0
+        self.errors = 0
+        # calls routed here because the preferred route was overloaded or failed
+        self.fallbacks = 0
+        self.in_flight = 0
+        self.unhealthy_until = 0.0
+        self.latencies: Deque[float] = deque(maxlen=window)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        values = sorted(self.latencies)
+        return round(values[min(len(values) - 1, int(round(q * (len(values) - 1))))], 3)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "fallbacks": self.fallbacks,
+            "in_flight": self.in_flight,
+            "p50_seconds": self.percentile(0.50),
+            "p95_seconds": self.percentile(0.95),
+        }
+
+
+class ModelRouter:
+    """
+    Sends each model call to the small or the large model, by the complexity
+    of the turn, and falls back to the other one when its model is overloaded.
+
+    A route is overloaded while `max_concurrency` of its calls are running, and
+    for `cooldown` seconds after one of its calls failed. A failed call is
+    retried once on the other route. A route whose model is missing is not
+    used again, its calls go to the other route.
+
+    Parameters
+    ----------
+    get_model : Callable[[str], Runnable]
+        Returns the chat model, with tools bound, of a model name.
+    routes : Dict[str, str]
+        The model name of the `SMALL` and the `LARGE` route.
+    classifier : Callable[[Sequence[BaseMessage]], str]
+        Returns the preferred route of the messages, `classify` by default.
+    max_concurrency : Dict[str, int], optional
+        The calls running at a time on a route before it counts as overloaded.
+    cooldown : float
+        Seconds a route is avoided after a failed call.
+    missing : Callable[[BaseException], bool]
+        Whether an error means the model of the route is missing, `model_missing` by default.
+    """
+
+    def __init__(
+        self,
+        get_model: Callable[[str], Any],
+        routes: Dict[str, str],
+        classifier: Callable[[Sequence[BaseMessage]], str] = classify,
+        max_concurrency: Optional[Dict[str, int]] = None,
+        cooldown: float = 30.0,
+        missing: Callable[[BaseException], bool] = model_missing,
+    ) -> None:
+        self.get_model = get_model
+        self.routes = routes
+        self.classifier = classifier
+        self.max_concurrency = {SMALL: 8, LARGE: 2, **(max_concurrency or {})}
+        self.cooldown = cooldown
+        self.is_missing = missing
+        # routes whose model is missing
+        self.missing: Set[str] = set()
+        self.routed = {route: 0 for route in routes}
+        self._stats = {route: RouteStats() for route in routes}
+        self._lock = threading.Lock()
+
+    def _overloaded(self, route: str) -> bool:
+        stats = self._stats[route]
+        return stats.in_flight >= self.max_concurrency[route] or stats.unhealthy_until > time.monotonic()
+
+    def _pick(self, preferred: str) -> str:
+        other = LARGE if preferred == SMALL else SMALL
+        with self._lock:
+            self.routed[preferred] += 1
+            if preferred in self.missing and other not in self.missing:
+                route = other
+            elif other in self.missing:
+                route = preferred
+            else:
+                route = other if self._overloaded(preferred) and not self._overloaded(other) else preferred
+            if route != preferred:
+                self._stats[route].fallbacks += 1
+            self._stats[route].in_flight += 1
+        return route
+
+    def _call(self, route: str, messages: Sequence[Any], call: Optional[Callable[[Any, Sequence[Any]], AIMessage]]) -> AIMessage:
+        stats = self._stats[route]
+        model = self.get_model(self.routes[route])
+        start = time.perf_counter()
+        try:
+            response = call(model, messages) if call is not None else model.invoke(messages)
+        except Exception as e:
+            with self._lock:
+                stats.errors += 1
+                stats.unhealthy_until = time.monotonic() + self.cooldown
+                if self.is_missing(e):
+                    self.missing.add(route)
+            raise
+        finally:
+            with self._lock:
+                stats.in_flight -= 1
+                stats.calls += 1
+        stats.latencies.append(time.perf_counter() - start)
+        response.response_metadata["route"] = route
+        return response
+
+    def invoke(
+        self,
+        messages: Sequence[Any],
+        state_messages: Sequence[BaseMessage],
+        call: Optional[Callable[[Any, Sequence[Any]], AIMessage]] = None,
+    ) -> AIMessage:
+        """
+        call the model of the route `state_messages` are classified to.
+
+        Parameters
+        ----------
+        messages : Sequence
+            The model input, with the system prompt.
+        state_messages : Sequence[BaseMessage]
+            The conversation the route is chosen by.
+        call : Callable[[Runnable, Sequence], AIMessage], optional
+            Calls the chosen model, `model.invoke(messages)` by default.
+        """
+        route = self._pick(self.classifier(state_messages))
+        try:
+            return self._call(route, messages, call)
+        except Exception:
+            other = LARGE if route == SMALL else SMALL
+            if other in self.missing:
+                raise
+            with self._lock:
+                self._stats[other].fallbacks += 1
+                self._stats[other].in_flight += 1
+            return self._call(other, messages, call)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                route: {
+                    "model": self.routes[route],
+                    "missing": route in self.missing,
+                    "routed": self.routed[route],
+                    **self._stats[route].to_dict(),
+                }
+                for route in self.routes
+            }
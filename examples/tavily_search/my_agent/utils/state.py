@@ -1,6 +1,8 @@
 from langgraph.graph import add_messages
 from langchain_core.messages import BaseMessage
-from typing import TypedDict, Annotated, Sequence
+from typing import Any, Dict, TypedDict, Annotated, Sequence
 
 class AgentState(TypedDict):
-    messages: Annotated[Sequence[BaseMessage], add_messages]
\ No newline at end of file
+    messages: Annotated[Sequence[BaseMessage], add_messages]
+    # the calls, errors and latencies per route of the model router, with model_name "auto"
+    model_routes: Dict[str, Any]
\ No newline at end of file
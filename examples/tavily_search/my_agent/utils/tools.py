@@ -1,3 +1,210 @@
-from langchain_tavily import TavilySearch
+import os
+import re
+import copy
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Protocol, Tuple, Type
 
-tools = [TavilySearch(max_results=1)]
\ No newline at end of file
+from pydantic import BaseModel, Field
+from langchain_core.tools import BaseTool, ToolException
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+class SearchBackend(Protocol):
+    """Anything answering a single search query with a Tavily-like result dict."""
+
+    def search(self, query: str) -> Dict[str, Any]:
+        ...
+
+
+class TavilyBackend:
+    """Searches the web with `TavilySearch`, created on first use."""
+
+    def __init__(self, max_results: int = 1) -> None:
+        self.max_results = max_results
+        self._tool = None
+
+    def search(self, query: str) -> Dict[str, Any]:
+        if self._tool is None:
+            from langchain_tavily import TavilySearch
+            self._tool = TavilySearch(max_results=self.max_results)
+        result = self._tool.invoke({"query": query})
+        # TavilySearch returns failures as {"error": e}, raise them so they are not cached
+        if "error" in result:
+            raise ToolException(str(result["error"]))
+        return result
+
+
+class LocalSearchBackend:
+    """
+    An offline stand-in for benchmarks, answering from a fixed set of documents.
+
+    Parameters
+    ----------
+    documents : Dict[str, str], optional
+        Document contents by url, ranked by the words they share with the query.
+    latency : float
+        Seconds each search sleeps, to simulate the remote call.
+    max_results : int
+        The maximum number of results per query.
+    """
+
+    def __init__(self, documents: Optional[Dict[str, str]] = None, latency: float = 0.5, max_results: int = 1) -> None:
+        self.documents = documents or {}
+        self.latency = latency
+        self.max_results = max_results
+        self.calls = 0
+
+    def search(self, query: str) -> Dict[str, Any]:
+        self.calls += 1
+        time.sleep(self.latency)
+        words = set(query.lower().split())
+        scored = sorted(
+            ((len(words & set(content.lower().split())), url, content) for url, content in self.documents.items()),
+            reverse=True,
+        )
+        results = [
+            {"title": url, "url": url, "content": content, "score": score / max(len(words), 1)}
+            for score, url, content in scored[:self.max_results] if score > 0
+        ]
+        if not results:
+            # still return something, like a web search would
+            digest = hashlib.sha1(query.encode("utf-8")).hexdigest()[:8]
+            results = [{
+                "title": query, "url": f"https://example.com/{digest}",
+                "content": f"Local stand-in result for: {query}", "score": 0.0,
+            }]
+        return {"query": query, "results": results}
+
+
+class SearchCache:
+    """
+    LRU cache with a TTL in front of a search backend, coalescing concurrent
+    identical queries into a single backend call.
+
+    Queries are compared after lowercasing and collapsing whitespace. Failed
+    searches are not cached, the error is raised to every waiting caller.
+    Every caller gets its own copy of the result.
+
+    Parameters
+    ----------
+    backend : SearchBackend
+        The backend answering cache misses.
+    max_entries : int
+        The maximum number of results kept.
+    ttl : float
+        Seconds a result stays valid.
+    """
+
+    def __init__(self, backend: SearchBackend, max_entries: int = 1024, ttl: float = 3600.0) -> None:
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query: str) -> str:
+        return _WHITESPACE.sub(" ", query).strip().lower()
+
+    def search(self, query: str) -> Dict[str, Any]:
+        key = self.key(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            waiting = self._inflight.get(key)
+            if waiting is None:
+                self.misses += 1
+                future = self._inflight[key] = Future()
+            else:
+                self.coalesced += 1
+        if waiting is not None:
+            # the same query is being searched, wait for its result
+            return copy.deepcopy(waiting.result())
+
+        try:
+            result = self.backend.search(query)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            self._entries[key] = (time.time() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        future.set_result(result)
+        return copy.deepcopy(result)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.coalesced + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+
+class CachedSearchInput(BaseModel):
+    queries: List[str] = Field(description=
+        "One or more search queries, all of them are searched at the same time.\n"
+        "Put every query needed to answer the question in one call."
+    )
+
+
+class CachedSearch(BaseTool):
+    """
+    Tool that searches the web through a `SearchCache`, fanning out several queries concurrently.
+
+    A failed search is answered with an error message the model can react to,
+    instead of failing the graph run.
+    """
+
+    name: str = "tavily_search"
+    description: str = (
+        "A search engine optimized for comprehensive, accurate, and trusted results. "
+        "Useful for when you need to answer questions about current events."
+    )
+    args_schema: Type[BaseModel] = CachedSearchInput
+    cache: SearchCache
+    max_concurrency: int = 8
+    handle_tool_error: bool = True
+
+    def _run(self, queries: List[str]) -> List[Dict[str, Any]]:
+        if not queries:
+            return []
+        try:
+            if len(queries) == 1:
+                return [self.cache.search(queries[0])]
+            with ThreadPoolExecutor(max_workers=min(len(queries), self.max_concurrency)) as executor:
+                return list(executor.map(self.cache.search, queries))
+        except ToolException:
+            raise
+        except Exception as e:
+            raise ToolException(f"{type(e).__name__}: {e}") from e
+
+
+def _backend() -> SearchBackend:
+    # SEARCH_BACKEND=local searches offline, e.g. for benchmarks
+    if os.getenv("SEARCH_BACKEND", "tavily") == "local":
+        return LocalSearchBackend()
+    return TavilyBackend(max_results=1)
+
+
+search_cache = SearchCache(_backend())
+tools = [CachedSearch(cache=search_cache)]
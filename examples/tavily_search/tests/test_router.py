@@ -0,0 +1,88 @@
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph import END, START, StateGraph
+from ollama import ResponseError
+
+from my_agent.utils import nodes
+from my_agent.utils.router import LARGE, SMALL, ModelRouter
+from my_agent.utils.state import AgentState
+
+
+class FakeModel:
+    """answers with its name, or raises `error`"""
+
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+        self.calls = 0
+
+    def invoke(self, messages):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return AIMessage(self.name)
+
+
+def make_router(small_error=None):
+    models = {
+        "small": FakeModel("small", small_error),
+        "large": FakeModel("large"),
+    }
+    return ModelRouter(models.__getitem__, {SMALL: "small", LARGE: "large"}), models
+
+
+def test_missing_small_model_sends_every_turn_to_the_large_one():
+    router, models = make_router(ResponseError('model "qwen3:1.7b" not found', 404))
+    question = [HumanMessage("capital of france")]
+
+    for _ in range(3):
+        assert router.invoke(question, question).content == "large"
+    # tried once, never again once it is known to be missing
+    assert models["small"].calls == 1
+    stats = router.stats()
+    assert stats[SMALL]["missing"] and not stats[LARGE]["missing"]
+    assert stats[LARGE]["calls"] == 3
+
+
+def test_failed_small_model_is_retried_after_its_cooldown():
+    router, models = make_router(ResponseError("server busy", 503))
+    router.cooldown = 0
+    question = [HumanMessage("capital of france")]
+
+    for _ in range(2):
+        assert router.invoke(question, question).content == "large"
+    assert models["small"].calls == 2
+    assert not router.stats()[SMALL]["missing"]
+
+
+def run_agent(model_name=None):
+    builder = StateGraph(AgentState)
+    builder.add_node("agent", nodes.call_model)
+    builder.add_edge(START, "agent")
+    builder.add_edge("agent", END)
+    config = {"configurable": {"stream_tools": False}}
+    if model_name is not None:
+        config["configurable"]["model_name"] = model_name
+    return builder.compile().invoke({"messages": [HumanMessage("capital of france")]}, config)
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    router, models = make_router()
+    monkeypatch.setattr(nodes, "router", router)
+    monkeypatch.setattr(nodes, "_get_model", lambda name: models["large" if name == "qwen3" else "small"])
+    return models
+
+
+def test_default_model_skips_the_router(fake_models):
+    result = run_agent()
+    assert result["messages"][-1].content == "large"
+    assert "model_routes" not in result
+    assert nodes.router.stats()[SMALL]["routed"] == 0
+
+
+def test_auto_returns_the_router_stats(fake_models):
+    result = run_agent("auto")
+    assert result["messages"][-1].content == "small"
+    assert result["model_routes"][SMALL]["calls"] == 1
+    assert result["model_routes"][LARGE]["calls"] == 0
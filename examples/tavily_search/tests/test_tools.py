@@ -0,0 +1,51 @@
+from langchain_core.messages import AIMessage, ToolMessage
+from langgraph.graph import END, START, MessagesState, StateGraph
+from langgraph.prebuilt import ToolNode
+
+from my_agent.utils.tools import CachedSearch, LocalSearchBackend, SearchCache, TavilyBackend
+
+
+class RateLimitedSearch:
+    """stands in for TavilySearch, which returns its failures instead of raising them"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def invoke(self, payload):
+        self.calls += 1
+        return {"error": "rate limited"}
+
+
+def run_search(tool, queries):
+    builder = StateGraph(MessagesState)
+    builder.add_node("tools", ToolNode([tool]))
+    builder.add_edge(START, "tools")
+    builder.add_edge("tools", END)
+    call = {"name": tool.name, "args": {"queries": queries}, "id": "call-1", "type": "tool_call"}
+    result = builder.compile().invoke({"messages": [AIMessage("", tool_calls=[call])]})
+    return next(m for m in result["messages"] if isinstance(m, ToolMessage))
+
+
+def test_failed_search_is_an_error_result_and_not_cached():
+    backend = TavilyBackend()
+    backend._tool = RateLimitedSearch()
+    tool = CachedSearch(cache=SearchCache(backend))
+
+    for _ in range(2):
+        message = run_search(tool, ["weather in paris"])
+        assert message.status == "error"
+        assert "rate limited" in message.content
+    assert backend._tool.calls == 2
+    assert tool.cache.stats()["entries"] == 0
+
+
+def test_cached_results_are_copies():
+    cache = SearchCache(LocalSearchBackend(latency=0))
+    cache.search("weather")["results"].clear()
+    assert cache.search("weather")["results"]
+
+
+def test_empty_queries():
+    message = run_search(CachedSearch(cache=SearchCache(LocalSearchBackend(latency=0))), [])
+    assert message.status == "success"
+    assert not message.content
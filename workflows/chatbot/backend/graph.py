@@ -1,21 +1,52 @@
 import sys
 import os
+import asyncio
+import time
+import hashlib
 
-from fastapi import FastAPI, HTTPException, Request, Query
+from fastapi import FastAPI, HTTPException, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse
 from pydantic import BaseModel
-from typing import List
+from typing import List, Literal, Optional
+from contextlib import asynccontextmanager
 
 from langchain_core.messages import HumanMessage, AIMessage
-# add parent directory to path for importing agent
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from my_agent.agent import graph
+# add workflows directory to path for importing agent
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from chatbot.my_agent.agent import compactor, root_graph as graph
+from chatbot.my_agent.utils.admission import Rejected, admission
+from chatbot.my_agent.utils.models import ModelWarmup
+from chatbot.my_agent.utils.threads import thread_lock
+from chatbot.my_agent.utils.tools import response_cache
+from chatbot.my_agent.utils.cache import bypass_requested
+from chatbot.my_agent.utils.metrics import (
+    ACTIVE_RUNS,
+    QUEUE_SECONDS,
+    REQUEST_SECONDS,
+    metrics_handler,
+    registry,
+    resident_bytes,
+)
+
+
+# loads the model in the background, `/ready` reports when it is done
+model_warmup = ModelWarmup()
+
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # load the model before routing users here, so the first user does not pay for it
+    model_warmup.start()
+    compactor.start()
+    yield
+    await model_warmup.stop()
+    compactor.stop()
 
-app = FastAPI(title="Chatbot API", version="1.0.0")
+
+app = FastAPI(title="Chatbot API", version="1.0.0", lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # set templates
@@ -29,6 +60,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(Rejected)
+async def rejected_handler(request: Request, exc: Rejected):
+    """the model server is saturated, the client should come back later"""
+    return JSONResponse(
+        {"detail": f"server busy: {exc.reason}", "retry_after": exc.retry_after},
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 # 请求和响应模型
 class ChatMessage(BaseModel):
     message: str
@@ -39,10 +79,27 @@ class ChatResponse(BaseModel):
 
 class ConversationHistory(BaseModel):
     messages: List[dict]
+    # pass as `cursor` to get the older messages, None on the first page of the conversation
+    next_cursor: Optional[str] = None
+
+class ConversationList(BaseModel):
+    conversations: List[str]
+    next_cursor: Optional[str] = None
+
+def thread_config(conversation_id: str) -> dict:
+    """graph config of a conversation, the graph checkpointer keeps its history"""
+    return {"configurable": {"thread_id": conversation_id}}
 
-# saves conversation history in memory
-# should be replaced with a storage backend in production
-conversations = {}
+def not_modified(request: Request, etag: str) -> bool:
+    """whether the client's copy, sent in If-None-Match, is still current"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+def cached_response(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 @app.get("/", response_class=HTMLResponse)
 async def index(request: Request):
@@ -54,8 +111,21 @@ async def root():
     """root path, returns API information"""
     return {"message": "Chatbot API is running", "version": "1.0.0"}
 
+@app.get("/ready")
+async def ready():
+    """readiness probe, 503 until the model is warmed up"""
+    if not model_warmup.ready:
+        return JSONResponse({"status": "warming up"}, status_code=503)
+    return {"status": "ready"}
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(chat_message: ChatMessage, conversation_id: str = "default"):
+async def chat(
+    chat_message: ChatMessage,
+    request: Request,
+    response: Response,
+    conversation_id: str = "default",
+    priority: Literal["interactive", "batch"] = "interactive",
+):
     """
     Chat with the LLM
     
@@ -64,67 +134,128 @@ async def chat(chat_message: ChatMessage, conversation_id: str = "default"):
             The user's input message
         conversation_id: str
             The unique identifier for the conversation, default is "default"
+        request: Request
+            `X-Cache-Bypass: 1` or `Cache-Control: no-cache` skips the response cache
+        priority: str
+            "interactive" requests are admitted before "batch" requests
     Returns:
         response: ChatResponse
             Contains the LLM's response and the conversation ID
     """
+    start = time.perf_counter()
+    # waits for a slot, or raises `Rejected`, answered with 429 and Retry-After
+    ticket = await admission.acquire(priority)
+    response.headers["X-Queue-Wait-Ms"] = f"{ticket.wait * 1000:.1f}"
     try:
-        if conversation_id not in conversations:
-            conversations[conversation_id] = []
-
-        # add user message
+        # only the new turn is sent, the checkpointer already holds the history
         user_message = HumanMessage(content=chat_message.message)
-        conversations[conversation_id].append(user_message)
-        
-        # 准备输入状态
-        input_state = {
-            "messages": conversations[conversation_id]
-        }
-        
-        # call the graph
-        result = graph.invoke(
-            input_state,
-            config={"configurable": {"thread_id": conversation_id}},
-            stream_mode='values'
-        )
-        
+        queued = time.perf_counter()
+        async with thread_lock(conversation_id):
+            QUEUE_SECONDS.observe(time.perf_counter() - queued)
+            ACTIVE_RUNS.inc()
+            try:
+                result = await graph.ainvoke(
+                    {"messages": [user_message]},
+                    config={
+                        "configurable": {
+                            "thread_id": conversation_id,
+                            "bypass_cache": bypass_requested(request.headers),
+                        },
+                        "callbacks": [metrics_handler],
+                    },
+                    stream_mode='values'
+                )
+            finally:
+                ACTIVE_RUNS.dec()
+                REQUEST_SECONDS.observe(time.perf_counter() - start, "/chat")
+
         # fetch llm response
         ai_response = result["messages"][-1]
-        
-        # update conversation history
-        conversations[conversation_id] = result["messages"]
-        
+
         return ChatResponse(
             response=ai_response.content,
             conversation_id=conversation_id
         )
-        
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"聊天处理失败: {str(e)}")
+    finally:
+        ticket.release()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """hit and miss counters of the response cache"""
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
+
+@app.get("/memory")
+async def memory_stats():
+    """memory of this worker process, and the conversations it holds in memory"""
+    stats = await asyncio.to_thread(graph.checkpointer.memory_stats)
+    return {"pid": os.getpid(), "resident_bytes": resident_bytes(), **stats}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """latency histograms and counters in the Prometheus text format"""
+    return registry.render()
 
 @app.get("/conversations/{conversation_id}/history", response_model=ConversationHistory)
-async def get_conversation_history(conversation_id: str):
+async def get_conversation_history(
+    conversation_id: str,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+):
     """
-    Get conversation history
-    
+    Get conversation history, newest page first
+
     Args:
         conversation_id: str
             The unique identifier for the conversation
+        cursor: str
+            The `next_cursor` of the previous page, the latest messages if not set
+        limit: int
+            The maximum number of messages in the page
     Returns:
         message: ConversationHistory
-            The list of messages in the conversation
+            The messages of the page in chronological order and the cursor of the older page
+
+    The ETag changes with every checkpoint, a request sending it in `If-None-Match`
+    gets 304 without the history being loaded.
     """
-    if conversation_id not in conversations:
-        return ConversationHistory(messages=[])
-    
+    # the checkpointer may read from disk, off the event loop
+    checkpointer = graph.checkpointer
+    etag = f'"{await asyncio.to_thread(checkpointer.latest_checkpoint_id, conversation_id) or "empty"}"'
+    if not_modified(request, etag):
+        return cached_response(etag)
+
+    # the latest checkpoint holds the messages, no need to build the whole graph state
+    checkpoint = await checkpointer.aget_tuple(thread_config(conversation_id))
+    all_messages = checkpoint.checkpoint["channel_values"].get("messages", []) if checkpoint else []
+    etag = f'"{checkpoint.checkpoint["id"]}"' if checkpoint else '"empty"'
+
+    # messages are only ever appended, so an index stays valid as a cursor
+    try:
+        end = len(all_messages) if cursor is None else min(int(cursor), len(all_messages))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"invalid cursor: {cursor}")
+
     messages = []
-    for msg in conversations[conversation_id]:
+    index = end
+    while index > 0 and len(messages) < limit:
+        index -= 1
+        msg = all_messages[index]
         if isinstance(msg, HumanMessage):
             messages.append({"type": "human", "content": msg.content})
         elif isinstance(msg, AIMessage):
             messages.append({"type": "ai", "content": msg.content})
-    
-    return ConversationHistory(messages=messages)
+    messages.reverse()
+
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return ConversationHistory(messages=messages, next_cursor=str(index) if index > 0 else None)
 
 @app.delete("/conversations/{conversation_id}")
 async def clear_conversation(conversation_id: str):
@@ -135,18 +266,43 @@ async def clear_conversation(conversation_id: str):
         conversation_id: str
             The unique identifier for the conversation
     """
-    if conversation_id in conversations:
-        del conversations[conversation_id]
+    if await asyncio.to_thread(graph.checkpointer.has_thread, conversation_id):
+        await graph.checkpointer.adelete_thread(conversation_id)
         return {"message": f"会话 {conversation_id} 已清除"}
     else:
         return {"message": f"会话 {conversation_id} 不存在"}
 
-@app.get("/conversations")
-async def list_conversations():
+@app.get("/conversations", response_model=ConversationList)
+async def list_conversations(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
     """
-    list all conversation in the memory
+    list the conversations in the checkpointer, sorted by id
+
+    Args:
+        cursor: str
+            The `next_cursor` of the previous page, the first page if not set
+        limit: int
+            The maximum number of conversations in the page
+
+    The ETag is a digest of the page, the same in every worker and after a restart,
+    it changes when a conversation of the page is added or removed.
     """
-    return {"conversations": list(conversations.keys())}
+    # listing a page is an index scan, only sending it is saved on a match
+    conversations = await asyncio.to_thread(graph.checkpointer.list_threads, after=cursor, limit=limit)
+    etag = '"%s"' % hashlib.sha1("\n".join(conversations).encode("utf-8")).hexdigest()[:20]
+    if not_modified(request, etag):
+        return cached_response(etag)
+
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+    return ConversationList(
+        conversations=conversations,
+        next_cursor=conversations[-1] if len(conversations) == limit else None,
+    )
 
 if __name__ == "__main__":
     import uvicorn
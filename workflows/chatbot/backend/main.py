@@ -1,13 +1,56 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
+from contextlib import suppress
+from typing import AsyncIterator, Literal
 import asyncio
 import json
+import os
+import time
+import zlib
 
-from chatbot.my_agent.agent import root_graph
+from chatbot.my_agent.agent import compactor, root_graph
+from chatbot.my_agent.utils.admission import Rejected, Ticket, admission
+from chatbot.my_agent.utils.models import ModelWarmup
+from chatbot.my_agent.utils.threads import thread_lock
+from chatbot.my_agent.utils.tools import response_cache
+from chatbot.my_agent.utils.cache import bypass_requested
+from chatbot.my_agent.utils.metrics import (
+    ACTIVE_RUNS,
+    QUEUE_SECONDS,
+    REQUEST_SECONDS,
+    TIME_TO_FIRST_TOKEN_SECONDS,
+    metrics_handler,
+    registry,
+    resident_bytes,
+)
+
+
+# streamed tokens are sent in batches, flushed after this many milliseconds
+# or bytes, clients can override both per request, 0 ms sends every token
+SSE_FLUSH_MS = float(os.getenv("CHATBOT_SSE_FLUSH_MS", "20"))
+SSE_FLUSH_BYTES = int(os.getenv("CHATBOT_SSE_FLUSH_BYTES", "1024"))
+# tokens read from the graph ahead of the frames sent, beyond it the graph waits for the client
+SSE_MAX_PENDING_TOKENS = int(os.getenv("CHATBOT_SSE_MAX_PENDING_TOKENS", "64"))
+
+
+# loads the model in the background, `/ready` reports when it is done
+model_warmup = ModelWarmup()
 
-app = FastAPI(title="Chatbot", version="0.0.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # load the model before routing users here, so the first user does not pay for it
+    model_warmup.start()
+    compactor.start()
+    yield
+    await model_warmup.stop()
+    compactor.stop()
+
+
+app = FastAPI(title="Chatbot", version="0.0.0", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -16,6 +59,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.exception_handler(Rejected)
+async def rejected_handler(request: Request, exc: Rejected):
+    """the model server is saturated, the client should come back later"""
+    return JSONResponse(
+        {"detail": f"server busy: {exc.reason}", "retry_after": exc.retry_after},
+        status_code=429,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+class AdmittedStreamingResponse(StreamingResponse):
+    """releases the admission ticket once the stream ended, also if it never started"""
+
+    def __init__(self, content, ticket: Ticket, **kwargs):
+        super().__init__(content, **kwargs)
+        self.ticket = ticket
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.ticket.release()
+
 class UserMessage(BaseModel):
     message: str
 
@@ -27,31 +92,198 @@ def health():
     return {"status": "ok"}
 
 
+@app.get("/ready")
+def ready():
+    """readiness probe, 503 until the model is warmed up"""
+    if not model_warmup.ready:
+        return JSONResponse({"status": "warming up"}, status_code=503)
+    return {"status": "ready"}
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """hit and miss counters of the response cache"""
+    if response_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **response_cache.stats()}
+
+
+@app.get("/memory")
+def memory_stats():
+    """memory of this worker process, and the conversations it holds in memory"""
+    return {"pid": os.getpid(), "resident_bytes": resident_bytes(), **root_graph.checkpointer.memory_stats()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """latency histograms and counters in the Prometheus text format"""
+    return registry.render()
+
+
 @app.post("/chat", response_model=AgentResponse)
 async def chat(user_message: UserMessage):
     return AgentResponse(response=f"echo: {user_message.message}")
 
 
-def agent_streaming_response(message: str):
+async def agent_streaming_response(message: str, thread_id: str, bypass_cache: bool = False):
     """streaming response from the agent"""
-    events = root_graph.stream(
-        input={'messages': [{'role': 'user', 'content': message}]},
-        config={'configurable': {'thread_id': '1'}},
-        stream_mode='messages'
-    )
-    for event in events:
-        msg, _ = event
-        token = msg.content
-        yield token
+    # turns on the same conversation are queued, other conversations run concurrently
+    queued = time.perf_counter()
+    async with thread_lock(thread_id):
+        QUEUE_SECONDS.observe(time.perf_counter() - queued)
+        events = root_graph.astream(
+            input={'messages': [{'role': 'user', 'content': message}]},
+            config={
+                'configurable': {'thread_id': thread_id, 'bypass_cache': bypass_cache},
+                'callbacks': [metrics_handler],
+            },
+            stream_mode='messages'
+        )
+        ACTIVE_RUNS.inc()
+        try:
+            async for event in events:
+                msg, metadata = event
+                # skip tokens of other nodes, e.g. the context summary
+                if metadata.get("langgraph_node") != "chatbot":
+                    continue
+                token = msg.content
+                yield token
+        finally:
+            # closing the graph stream cancels the running node and its LLM request
+            await events.aclose()
+            ACTIVE_RUNS.dec()
+
+async def coalesce_tokens(tokens: AsyncIterator[str], flush_ms: float, flush_bytes: int,
+                          max_pending: int = SSE_MAX_PENDING_TOKENS):
+    """
+    merge streamed tokens into batches, a batch is sent `flush_ms` after its first
+    token or once it reaches `flush_bytes`. The first token is sent on its own, so
+    the time to first token does not change, and empty tokens are dropped.
+
+    The token stream is read at most `max_pending` tokens ahead of the batches
+    taken, so a slow client still slows the graph run down.
+    """
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+    done = object()
+
+    # the token stream is consumed by one task, the graph stream must not change tasks
+    async def produce():
+        try:
+            async for token in tokens:
+                if token:
+                    await queue.put(token)
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(done)
+
+    producer = asyncio.create_task(produce())
+    loop = asyncio.get_running_loop()
+    batch, size, deadline, first = [], 0, None, True
+    try:
+        while True:
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+            if item is done or isinstance(item, Exception):
+                if batch:
+                    yield "".join(batch)
+                if item is not done:
+                    raise item
+                return
+            if item is not None:
+                batch.append(item)
+                size += len(item)
+                deadline = deadline or loop.time() + flush_ms / 1000
+            if batch and (first or item is None or size >= flush_bytes):
+                yield "".join(batch)
+                batch, size, deadline, first = [], 0, None, False
+    finally:
+        # stops the graph run when the client goes away
+        producer.cancel()
+        with suppress(asyncio.CancelledError):
+            await producer
 
 @app.post("/chat/stream")
-async def chat_stream(user_message: UserMessage):
+async def chat_stream(
+    user_message: UserMessage,
+    request: Request,
+    conversation_id: str = "default",
+    flush_ms: float = SSE_FLUSH_MS,
+    flush_bytes: int = SSE_FLUSH_BYTES,
+    compress: bool = False,
+    priority: Literal["interactive", "batch"] = "interactive",
+):
+    """
+    Stream the LLM response as server-sent events
+
+    Args:
+        user_message: UserMessage
+            The user's input message
+        conversation_id: str
+            The unique identifier for the conversation, used as the graph thread id
+        flush_ms: float
+            Tokens are sent in batches at most this many milliseconds apart,
+            0 sends one event per token
+        flush_bytes: int
+            A batch is sent early once it holds this many characters
+        compress: bool
+            Gzip the stream if the client accepts it
+        priority: str
+            "interactive" requests are admitted before "batch" requests
+
+    Answers 429 with Retry-After when the model server is saturated, the time spent
+    waiting for admission is returned in `X-Queue-Wait-Ms`.
+    Send `X-Cache-Bypass: 1` or `Cache-Control: no-cache` to skip the response cache.
+    """
+    start = time.perf_counter()
+    # waits for a slot, or raises `Rejected` before the stream starts
+    ticket = await admission.acquire(priority)
+    gzip = compress and "gzip" in request.headers.get("accept-encoding", "")
+
     async def event_generator():
-        for token in agent_streaming_response(user_message.message):
-            # SSE event
-            yield f'data: {json.dumps({"token": token})}\n\n'
-        yield 'data: {"end": true}\n\n'
-    return StreamingResponse(event_generator(), media_type="text/event-stream")
+        # the next frame is only pulled after the previous one has been sent, the
+        # graph runs at most `SSE_MAX_PENDING_TOKENS` tokens ahead of it
+        tokens = agent_streaming_response(
+            user_message.message, conversation_id, bypass_requested(request.headers)
+        )
+        chunks = coalesce_tokens(tokens, flush_ms, flush_bytes) if flush_ms > 0 else tokens
+        # every frame is flushed from the compressor, so it reaches the client at once
+        compressor = zlib.compressobj(wbits=31) if gzip else None
+
+        def encode(frame: str) -> bytes:
+            if compressor is None:
+                return frame.encode("utf-8")
+            return compressor.compress(frame.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        first = True
+        try:
+            async for token in chunks:
+                if not token:
+                    continue
+                if await request.is_disconnected():
+                    return
+                if first:
+                    TIME_TO_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - start, "/chat/stream")
+                    first = False
+                # SSE event
+                yield encode(f'data: {json.dumps({"token": token})}\n\n')
+            yield encode('data: {"end": true}\n\n')
+            if compressor is not None:
+                yield compressor.flush()
+        finally:
+            await chunks.aclose()
+            await tokens.aclose()
+            REQUEST_SECONDS.observe(time.perf_counter() - start, "/chat/stream")
+
+    headers = {"X-Queue-Wait-Ms": f"{ticket.wait * 1000:.1f}"}
+    if gzip:
+        headers.update({"Content-Encoding": "gzip", "Vary": "Accept-Encoding"})
+    return AdmittedStreamingResponse(
+        event_generator(), ticket, media_type="text/event-stream", headers=headers
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+"""
+Serve a backend app from worker processes forked from a preloaded master.
+
+The master imports the app, which compiles the graph, and binds the listening
+sockets once, then forks the workers. The workers start without importing or
+compiling anything and share the master's memory copy-on-write. Each worker
+warms up the model on its own and reports ready at `/ready` once it answered.
+
+Every worker keeps the conversations it served in its own memory, as the
+authoritative copy, so all turns of a conversation must reach the same worker.
+Workers therefore do not share a socket. Clients connect to `port`, where a
+router process reads the conversation of each request, from the
+`conversation_id` query parameter or a `/conversations/<id>` path, and forwards
+the request to worker `worker_index(conversation_id, workers)`, which listens
+on `port + 1 + index`. Requests without a conversation go to the worker of the
+"default" conversation, the one the endpoints use without one. Each routed
+connection carries a single request, the router closes it after the response.
+A worker's own port can be used to reach it directly, e.g. for its `/ready` or
+`/metrics`. A restarted worker or router listens on the port of the one it
+replaces. A single worker serves `port` itself, without a router.
+
+Run from the `workflows` directory:
+
+    python -m chatbot.backend.serve main --workers 4 --port 8000
+"""
+import gc
+import os
+import time
+import signal
+import zlib
+import socket
+import asyncio
+import logging
+import argparse
+from contextlib import suppress
+from importlib import import_module
+from typing import Any, Callable, Dict, List, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import uvicorn
+
+logger = logging.getLogger("chatbot.serve")
+
+# a worker exiting sooner than this after its start is not restarted
+MIN_WORKER_UPTIME = 5.0
+
+
+def preload(app_name: str) -> Any:
+    """import the app and the modules its requests need, once for all workers"""
+    start = time.perf_counter()
+    if app_name == "graph":
+        # graph.py mounts these from the working directory
+        os.makedirs("static", exist_ok=True)
+        os.makedirs("templates", exist_ok=True)
+    app = import_module(f"chatbot.backend.{app_name}").app
+    # imported on first use otherwise, i.e. by every worker
+    import langchain_ollama  # noqa: F401
+    logger.info("preloaded %s in %.2f s", app_name, time.perf_counter() - start)
+    return app
+
+
+def worker_index(conversation_id: str, workers: int) -> int:
+    """the worker serving a conversation, it listens on `port + 1 + worker_index(...)`"""
+    return zlib.crc32(conversation_id.encode("utf-8")) % max(workers, 1)
+
+
+def conversation_of(target: str) -> str:
+    """the conversation of a request target, "default" like the endpoints if it has none"""
+    parts = urlsplit(target)
+    query = parse_qs(parts.query).get("conversation_id")
+    if query:
+        return query[0]
+    segments = parts.path.split("/")
+    if len(segments) > 2 and segments[1] == "conversations" and segments[2]:
+        return unquote(segments[2])
+    return "default"
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    while True:
+        data = await reader.read(65536)
+        if not data:
+            break
+        writer.write(data)
+        await writer.drain()
+
+
+async def _route(client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter,
+                 host: str, ports: List[int]) -> None:
+    """forward one request to the worker of its conversation, and its response back"""
+    worker_writer = None
+    try:
+        head = await client_reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        target = lines[0].split(" ")[1]
+        # one request per connection, the next one may belong to another worker
+        headers = [line for line in lines[1:] if line and not line.lower().startswith("connection:")]
+        head = "\r\n".join([lines[0], *headers, "Connection: close", "", ""]).encode("latin-1")
+
+        port = ports[worker_index(conversation_of(target), len(ports))]
+        worker_reader, worker_writer = await asyncio.open_connection(host, port)
+        worker_writer.write(head)
+        # the request body, until the worker answered and closed the connection
+        upload = asyncio.create_task(_pipe(client_reader, worker_writer))
+        try:
+            await _pipe(worker_reader, client_writer)
+        finally:
+            upload.cancel()
+            with suppress(asyncio.CancelledError):
+                await upload
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, IndexError, ConnectionError):
+        pass
+    finally:
+        for writer in (worker_writer, client_writer):
+            if writer is not None:
+                writer.close()
+
+
+def run_router(sock: socket.socket, host: str, ports: List[int]) -> None:
+    """forward the requests arriving on `sock` to the workers listening on `ports`"""
+    # the workers listen on the same interface, a wildcard address is reached on loopback
+    target = "127.0.0.1" if host in ("0.0.0.0", "") else "::1" if host == "::" else host
+
+    async def main():
+        server = await asyncio.start_server(lambda r, w: _route(r, w, target, ports), sock=sock)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+def bind(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app: Any, sock: socket.socket, log_level: str) -> None:
+    config = uvicorn.Config(app, lifespan="on", log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def spawn(run: Callable[[], None]) -> int:
+    pid = os.fork()
+    if pid:
+        return pid
+    # the master forwards SIGINT and SIGTERM, a terminal's SIGINT must not arrive twice
+    os.setpgid(0, 0)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    code = 0
+    try:
+        run()
+    except BaseException:
+        logger.exception("process %d failed", os.getpid())
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def serve(app_name: str, host: str = "127.0.0.1", port: int = 8000, workers: int = 1,
+          log_level: str = "info") -> None:
+    """
+    preload `app_name` and serve it on `port` from `workers` forked processes,
+    listening on the ports `port + 1` to `port + workers` behind a router,
+    a single worker is served by this process on `port`
+    """
+    app = preload(app_name)
+    if workers <= 1:
+        run_worker(app, bind(host, port), log_level)
+        return
+
+    sockets: List[socket.socket] = [bind(host, port + 1 + i) for i in range(workers)]
+    router = bind(host, port)
+    ports = [port + 1 + i for i in range(workers)]
+    # objects of the master are never collected by the workers, collecting
+    # them would write to, and so copy, the pages shared with the master
+    gc.freeze()
+    # a restarted process runs the same function
+    runs: List[Callable[[], None]] = [
+        (lambda sock=sock: run_worker(app, sock, log_level)) for sock in sockets
+    ] + [lambda: run_router(router, host, ports)]
+    # pid -> (run, start time)
+    started: Dict[int, Tuple[Callable[[], None], float]] = {}
+    for run in runs:
+        started[spawn(run)] = (run, time.monotonic())
+    logger.info("serving %s on %s:%d, routed to %d workers on ports %d-%d",
+                app_name, host, port, workers, port + 1, port + workers)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(started):
+            with suppress(ProcessLookupError):
+                os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    while started:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker = started.pop(pid, None)
+        if worker is None or stopping:
+            continue
+        run, start = worker
+        logger.warning("process %d exited with status %d", pid, os.waitstatus_to_exitcode(status))
+        if time.monotonic() - start < MIN_WORKER_UPTIME:
+            # it failed on startup, so would its replacement
+            stop(None, None)
+            continue
+        started[spawn(run)] = (run, time.monotonic())
+    for sock in sockets + [router]:
+        sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("app", choices=["main", "graph"], help="the backend app to serve")
+    parser.add_argument("--host", default=os.getenv("CHATBOT_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("CHATBOT_PORT", "8000")),
+                        help="the port clients connect to, with several workers worker i listens on port + 1 + i")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("CHATBOT_WORKERS", "1")))
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format="%(levelname)s:     %(message)s")
+    serve(args.app, args.host, args.port, args.workers, args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Benchmark the checkpointers of the chatbot graph.
+
+Measures the per-turn latency of the in-memory and the SQLite write-behind
+checkpointer, the checkpoint bytes added per turn as a conversation grows,
+the cold-start time of reopening a populated database, and how many turns
+survive when the writing process is killed.
+
+Run from the `workflows` directory:
+
+    python -m chatbot.benchmarks.bench_checkpoint --threads 50 --turns 20
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+from langchain_core.messages import AIMessage
+from langgraph.graph import StateGraph, START, END
+from langgraph.checkpoint.memory import InMemorySaver
+
+from chatbot.my_agent.utils.state import State
+from chatbot.my_agent.utils.checkpoint import BoundedInMemorySaver, WriteBehindSqliteSaver
+
+
+def echo(state: State):
+    # stands in for the model, so only the checkpointer is measured
+    return {"messages": [AIMessage(content="echo: " + state["messages"][-1].content)]}
+
+
+def build_graph(checkpointer):
+    builder = StateGraph(State)
+    builder.add_node("chatbot", echo)
+    builder.add_edge(START, "chatbot")
+    builder.add_edge("chatbot", END)
+    return builder.compile(checkpointer=checkpointer)
+
+
+def run_turns(graph, threads: int, turns: int, offset: int = 0):
+    """run `turns` turns on each thread and return the latency of every turn in ms"""
+    latencies = []
+    for turn in range(turns):
+        for thread in range(threads):
+            start = time.perf_counter()
+            graph.invoke(
+                {"messages": [{"role": "user", "content": f"message {offset + turn}"}]},
+                {"configurable": {"thread_id": f"thread-{thread}"}},
+            )
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    return {
+        "turns": len(latencies),
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 3),
+        "mean_ms": round(statistics.fmean(latencies), 3),
+    }
+
+
+def bench_write(path: str, threads: int, turns: int):
+    memory = build_graph(BoundedInMemorySaver())
+    durable_saver = WriteBehindSqliteSaver(path)
+    durable = build_graph(durable_saver)
+
+    report = {
+        "memory": summarize(run_turns(memory, threads, turns)),
+        "sqlite_write_behind": summarize(run_turns(durable, threads, turns)),
+    }
+    start = time.perf_counter()
+    durable_saver.close()
+    report["final_flush_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return report
+
+
+def bench_growth(turns: int):
+    """checkpoint bytes added per turn early and late in one long conversation"""
+    report = {}
+    for name, saver in [("full_copy", InMemorySaver()), ("message_delta", BoundedInMemorySaver())]:
+        graph = build_graph(saver)
+        sizes = []
+        for turn in range(turns):
+            graph.invoke(
+                {"messages": [{"role": "user", "content": f"message {turn}"}]},
+                {"configurable": {"thread_id": "long"}},
+            )
+            sizes.append(
+                sum(len(blob[1]) for blob in saver.blobs.values())
+                + sum(
+                    len(c[1]) + len(m[1])
+                    for ns in saver.storage["long"].values() for c, m, _ in ns.values()
+                )
+            )
+        window = max(turns // 10, 1)
+        report[name] = {
+            "total_bytes": sizes[-1],
+            "bytes_per_turn_first": (sizes[window] - sizes[0]) // window,
+            "bytes_per_turn_last": (sizes[-1] - sizes[-1 - window]) // window,
+        }
+    return report
+
+
+def bench_cold_start(path: str, threads: int):
+    start = time.perf_counter()
+    saver = WriteBehindSqliteSaver(path)
+    graph = build_graph(saver)
+    opened = time.perf_counter()
+    for thread in range(threads):
+        graph.get_state({"configurable": {"thread_id": f"thread-{thread}"}})
+    loaded = time.perf_counter()
+    saver.close()
+    return {
+        "open_ms": round((opened - start) * 1000, 3),
+        "load_all_threads_ms": round((loaded - opened) * 1000, 3),
+        "db_bytes": sum(
+            os.path.getsize(f) for f in (path, path + "-wal") if os.path.exists(f)
+        ),
+    }
+
+
+def bench_crash(path: str, threads: int, seconds: float):
+    """kill a writing process with SIGKILL and count the turns found on disk"""
+    child = subprocess.Popen(
+        [sys.executable, "-m", "chatbot.benchmarks.bench_checkpoint",
+         "--crash-child", path, "--threads", str(threads)],
+        stdout=subprocess.PIPE, text=True,
+    )
+    time.sleep(seconds)
+    child.send_signal(signal.SIGKILL)
+    output, _ = child.communicate()
+    # the child prints one line per completed round of turns
+    acknowledged = len(output.splitlines()) * threads
+
+    start = time.perf_counter()
+    saver = WriteBehindSqliteSaver(path)
+    graph = build_graph(saver)
+    recovered = 0
+    for thread in range(threads):
+        snapshot = graph.get_state({"configurable": {"thread_id": f"thread-{thread}"}})
+        recovered += len(snapshot.values.get("messages", [])) // 2
+    recovery_ms = (time.perf_counter() - start) * 1000
+    saver.close()
+    return {
+        "acknowledged_turns": acknowledged,
+        "recovered_turns": recovered,
+        "lost_turns": max(acknowledged - recovered, 0),
+        "recovery_ms": round(recovery_ms, 3),
+    }
+
+
+def crash_child(path: str, threads: int):
+    graph = build_graph(WriteBehindSqliteSaver(path))
+    turn = 0
+    while True:
+        run_turns(graph, threads, 1, offset=turn)
+        turn += 1
+        print(turn, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--long-turns", type=int, default=200, help="turns of the long conversation")
+    parser.add_argument("--crash-after", type=float, default=2.0, help="seconds before the writer is killed")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--crash-child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.crash_child:
+        crash_child(args.crash_child, args.threads)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite")
+        report = {
+            "threads": args.threads,
+            "turns_per_thread": args.turns,
+            "write": bench_write(path, args.threads, args.turns),
+            "growth": bench_growth(args.long_turns),
+            "cold_start": bench_cold_start(path, args.threads),
+            "crash": bench_crash(os.path.join(tmp, "crash.sqlite"), args.threads, args.crash_after),
+        }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
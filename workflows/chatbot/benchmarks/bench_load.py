@@ -0,0 +1,289 @@
+"""
+Load-test the chatbot backends with a fake model.
+
+Each backend app (`main` or `graph`) is served by `backend/serve.py` in a child
+process where ChatOllama is replaced by `FakeChatModel`, and its endpoints are
+driven by concurrent clients, each holding its own conversation. Reports the
+cold start of the server, latency percentiles, time to first token of streamed
+responses, tokens per second and the server memory added per conversation,
+optionally compared to a baseline.
+
+Run from the `workflows` directory:
+
+    python -m chatbot.benchmarks.bench_load --concurrency 1 8 32 --output load.json
+    python -m chatbot.benchmarks.bench_load --compare load.json
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+# app name, endpoint, `main:/chat` is left out, it echoes without running the graph
+TARGETS = ["main:/chat/stream", "graph:/chat"]
+# metrics compared with the baseline and whether higher is better
+COMPARED = {"p95_ms": False, "ttft_p95_ms": False, "tokens_per_sec": True, "ready_ms": False}
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(round(q * (len(values) - 1))))], 3)
+
+
+def _children(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def pss_bytes(pid: int) -> Optional[int]:
+    """
+    proportional memory of a process and its workers, linux only. Pages shared
+    copy-on-write with the master are split between the processes sharing them.
+    """
+    total = None
+    for process in [pid] + _children(pid):
+        try:
+            with open(f"/proc/{process}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Pss:"):
+                        total = (total or 0) + int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            pass
+    return total
+
+
+def free_port(count: int = 1) -> int:
+    """the first of `count` consecutive free ports, for the router and one per server worker"""
+    while True:
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+        try:
+            for p in range(port, port + count):
+                with socket.socket() as s:
+                    s.bind(("127.0.0.1", p))
+            return port
+        except OSError:
+            continue
+
+
+def serve(app_name: str, port: int, workers: int, tokens: int, token_rate: float, latency: float):
+    """child process: serve a backend app with the fake model"""
+    from chatbot.benchmarks.fake_llm import install
+    from chatbot.backend.serve import serve
+
+    install(tokens=tokens, token_rate=token_rate, latency=latency)
+    serve(app_name, "127.0.0.1", port, workers, log_level="warning")
+
+
+async def one_request(client: httpx.AsyncClient, base_url: str, endpoint: str, conversation_id: str,
+                      message: str, flush_ms: Optional[float] = None):
+    """send one turn, return (latency_ms, ttft_ms, tokens)"""
+    start = time.perf_counter()
+    url = base_url + endpoint
+    params = {"conversation_id": conversation_id}
+    if endpoint == "/chat/stream":
+        if flush_ms is not None:
+            params["flush_ms"] = flush_ms
+        ttft, tokens = None, 0
+        async with client.stream("POST", url, json={"message": message}, params=params) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line[6:])
+                if event.get("token"):
+                    # an event may hold several tokens, the fake model answers one word per token
+                    tokens += len(event["token"].split())
+                    if ttft is None:
+                        ttft = (time.perf_counter() - start) * 1000
+        return (time.perf_counter() - start) * 1000, ttft, tokens
+
+    response = await client.post(url, json={"message": message}, params=params)
+    response.raise_for_status()
+    return (time.perf_counter() - start) * 1000, None, len(response.json()["response"].split())
+
+
+async def run_level(base_url: str, endpoint: str, concurrency: int, turns: int, prefix: str, pid: int,
+                    flush_ms: Optional[float] = None):
+    """`concurrency` clients each send `turns` turns on their own conversation"""
+    samples, errors, rejected = [], 0, 0
+
+    async def client_loop(client: httpx.AsyncClient, index: int):
+        nonlocal errors, rejected
+        for turn in range(turns):
+            try:
+                samples.append(await one_request(
+                    client, base_url, endpoint, f"{prefix}-{index}", f"message {turn} from client {index}", flush_ms
+                ))
+            except httpx.HTTPStatusError as e:
+                # turned away by admission control
+                if e.response.status_code == 429:
+                    rejected += 1
+                else:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        pss_before = pss_bytes(pid)
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, i) for i in range(concurrency)))
+        wall = time.perf_counter() - start
+        pss_after = pss_bytes(pid)
+
+    latencies = [s[0] for s in samples]
+    ttfts = [s[1] for s in samples if s[1] is not None]
+    tokens = sum(s[2] for s in samples)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "rejected": rejected,
+        "p50_ms": percentile(latencies, 0.50),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "ttft_p50_ms": percentile(ttfts, 0.50),
+        "ttft_p95_ms": percentile(ttfts, 0.95),
+        "ttft_p99_ms": percentile(ttfts, 0.99),
+        "requests_per_sec": round(len(samples) / wall, 3),
+        "tokens_per_sec": round(tokens / wall, 3),
+        "pss_bytes": pss_after,
+        "memory_per_conversation_bytes": (
+            (pss_after - pss_before) // concurrency if pss_before and pss_after else None
+        ),
+    }
+
+
+async def wait_ready(base_urls: List[str], path: str, timeout: float = 60.0):
+    """wait until `path` succeeds on every worker"""
+    async with httpx.AsyncClient() as client:
+        deadline = time.monotonic() + timeout
+        pending = list(base_urls)
+        while pending and time.monotonic() < deadline:
+            try:
+                if (await client.get(pending[0] + path)).status_code == 200:
+                    pending.pop(0)
+                    continue
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.01)
+    if pending:
+        raise RuntimeError(f"{pending[0]}{path} did not succeed within {timeout} seconds")
+
+
+def bench_target(target: str, args, workdir: str) -> Dict[str, Any]:
+    app_name, endpoint = target.split(":", 1)
+    # the router and a port per worker, see `backend/serve.py`
+    port = free_port(args.workers + 1 if args.workers > 1 else 1)
+    env = dict(os.environ, CHATBOT_CHECKPOINT_DB=args.checkpoint_db)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "chatbot.benchmarks.bench_load", "--serve", app_name, "--port", str(port),
+         "--workers", str(args.workers), "--tokens", str(args.tokens), "--token-rate", str(args.token_rate),
+         "--latency", str(args.latency)],
+        cwd=workdir, env=env,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    worker_urls = [f"http://127.0.0.1:{port + 1 + i}" for i in range(args.workers)] if args.workers > 1 else [base_url]
+    try:
+        # cold start: until the server accepts requests, and until every worker warmed up the model
+        asyncio.run(wait_ready([base_url], "/health" if app_name == "main" else "/api"))
+        listening = time.perf_counter() - start
+        asyncio.run(wait_ready(worker_urls, "/ready"))
+        results = {"cold_start": {
+            "listening_ms": round(listening * 1000, 3),
+            "ready_ms": round((time.perf_counter() - start) * 1000, 3),
+            "pss_bytes": pss_bytes(server.pid),
+        }}
+        # one turn first, so connection setup is not measured
+        asyncio.run(run_level(base_url, endpoint, 1, 1, "warmup", server.pid))
+        for c in args.concurrency:
+            results[f"c={c}"] = asyncio.run(
+                run_level(base_url, endpoint, c, args.turns, f"c{c}", server.pid, args.flush_ms)
+            )
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """the metrics which got worse than the baseline by more than `tolerance`"""
+    regressions = []
+    for target, levels in report["results"].items():
+        for level, metrics in levels.items():
+            old = baseline.get("results", {}).get(target, {}).get(level)
+            if not old:
+                continue
+            for name, higher_is_better in COMPARED.items():
+                new_value, old_value = metrics.get(name), old.get(name)
+                if not new_value or not old_value:
+                    continue
+                change = (new_value - old_value) / old_value
+                if (-change if higher_is_better else change) > tolerance:
+                    regressions.append(f"{target} {level} {name}: {old_value} -> {new_value} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--targets", nargs="+", default=TARGETS, help="app:endpoint pairs to drive")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--turns", type=int, default=5, help="turns per client and concurrency level")
+    parser.add_argument("--tokens", type=int, default=50, help="tokens per fake answer")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="fake tokens per second")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake seconds before the first token")
+    parser.add_argument("--flush-ms", type=float, help="SSE batching interval of /chat/stream, server default if unset")
+    parser.add_argument("--workers", type=int, default=1, help="server worker processes")
+    parser.add_argument("--checkpoint-db", default="", help="SQLite checkpoint file, in memory if empty")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="a previous JSON report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.workers, args.tokens, args.token_rate, args.latency)
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        report = {
+            "config": {
+                "concurrency": args.concurrency, "turns": args.turns, "tokens": args.tokens,
+                "token_rate": args.token_rate, "latency": args.latency,
+                "checkpoint_db": bool(args.checkpoint_db), "flush_ms": args.flush_ms, "workers": args.workers,
+            },
+            "results": {target: bench_target(target, args, workdir) for target in args.targets},
+        }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("regression:", regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+A deterministic stand-in for ChatOllama, used by the benchmarks to measure the
+backends without a model server.
+"""
+import time
+import asyncio
+import hashlib
+from typing import Any, AsyncIterator, List, Optional, Sequence
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+VOCABULARY = (
+    "the", "graph", "model", "token", "thread", "answer", "state", "message", "node",
+    "stream", "cache", "latency", "memory", "request", "server", "checkpoint",
+)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Answers with `tokens` words chosen by a hash of the last message, after
+    `latency` seconds, at `token_rate` tokens per second.
+    """
+
+    tokens: int = 50
+    token_rate: float = 200.0
+    latency: float = 0.05
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _reply(self, messages: Sequence[BaseMessage]) -> List[str]:
+        seed = hashlib.sha256(str(messages[-1].content if messages else "").encode("utf-8")).digest()
+        return [VOCABULARY[seed[i % len(seed)] % len(VOCABULARY)] + " " for i in range(self.tokens)]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency + self.tokens / self.token_rate)
+        content = "".join(self._reply(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency + self.tokens / self.token_rate)
+        content = "".join(self._reply(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency)
+        for token in self._reply(messages):
+            await asyncio.sleep(1 / self.token_rate)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager is not None:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> "FakeChatModel":
+        return self
+
+
+def install(**options: Any) -> FakeChatModel:
+    """make `get_model` return a `FakeChatModel` in this process"""
+    from chatbot.my_agent.utils import models
+
+    model = FakeChatModel(**options)
+    models._get_model = lambda model_name: model
+    models._bound_models.clear()
+    return model
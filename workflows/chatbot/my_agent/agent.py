@@ -1,16 +1,56 @@
+import os
+
 from langgraph.graph import StateGraph, START, END
+from langchain_core.runnables import RunnableLambda
 from chatbot.my_agent.utils.state import State
-from chatbot.my_agent.utils.tools import chatbot
+from chatbot.my_agent.utils.tools import chatbot, achatbot, context_window
+from chatbot.my_agent.utils.checkpoint import (
+    BoundedInMemorySaver,
+    CheckpointCompactor,
+    WriteBehindSqliteSaver,
+)
+from chatbot.my_agent.utils.metrics import instrument_checkpointer, registry
 from langgraph.checkpoint.memory import InMemorySaver
 
 # build a graph
 builder = StateGraph(State)
-builder.add_node("chatbot", chatbot)
-builder.add_edge(START, "chatbot")
+# keep the prompt under the token budget before calling the model
+builder.add_node("context", RunnableLambda(context_window.node, afunc=context_window.anode, name="context"))
+# sync runs use `chatbot`, async runs (astream/ainvoke) use `achatbot`
+builder.add_node("chatbot", RunnableLambda(chatbot, afunc=achatbot, name="chatbot"))
+builder.add_edge(START, "context")
+builder.add_edge("context", "chatbot")
 builder.add_edge("chatbot", END)
 
-# build graph
-memory = InMemorySaver()
+# build graph, least recently used and idle threads are evicted from memory
+# and only the last checkpoints of each thread are kept, the limits apply per process
+saver_options = dict(
+    max_threads=int(os.getenv("CHATBOT_MAX_THREADS", "1000")),
+    max_bytes=int(os.getenv("CHATBOT_MAX_CHECKPOINT_BYTES", str(256 * 1024 * 1024))),
+    ttl=float(os.getenv("CHATBOT_THREAD_TTL", "3600")),
+    keep_last=int(os.getenv("CHATBOT_KEEP_CHECKPOINTS", "20")),
+)
+# threads are persisted to SQLite unless CHATBOT_CHECKPOINT_DB is set to "", by default
+# next to the package so every worker uses the same file whatever its working directory,
+# the file is only opened by the first conversation
+checkpoint_db = os.getenv(
+    "CHATBOT_CHECKPOINT_DB", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "checkpoints.sqlite")
+)
+if checkpoint_db:
+    memory = WriteBehindSqliteSaver(checkpoint_db, **saver_options)
+else:
+    memory = BoundedInMemorySaver(**saver_options)
+instrument_checkpointer(memory)
+registry.gauge("chatbot_loaded_threads", "Conversations held in memory.", function=lambda: len(memory.storage))
+registry.gauge("chatbot_checkpoint_bytes", "Serialized checkpoints held in memory.", function=lambda: memory.total_bytes)
+registry.gauge("chatbot_evicted_threads", "Conversations evicted from memory.", function=lambda: memory.evicted_threads)
+if checkpoint_db:
+    registry.gauge(
+        "chatbot_rehydrated_threads", "Conversations loaded back from disk.", function=lambda: memory.rehydrated_threads
+    )
+# started by the backends, applies `keep_last` and hibernates the threads idle
+# for `CHATBOT_THREAD_TTL` seconds to disk in the background
+compactor = CheckpointCompactor(memory, interval=float(os.getenv("CHATBOT_COMPACTION_INTERVAL", "60")))
 root_graph = builder.compile(checkpointer=memory)
 
 # compile the graph
@@ -0,0 +1,168 @@
+import os
+import math
+import time
+import heapq
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List, Optional, Tuple
+
+from .metrics import ADMISSION_REJECTED, ADMISSION_SECONDS, registry
+
+# lower runs first, interactive chat is served before batch jobs
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+
+class Rejected(Exception):
+    """The request was not admitted, clients should retry after `retry_after` seconds."""
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """An admitted request, holding one slot until it is released."""
+
+    def __init__(self, controller: "AdmissionController", wait: float) -> None:
+        self.wait = wait
+        self._controller = controller
+        self._start = time.perf_counter()
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release(time.perf_counter() - self._start)
+
+
+class AdmissionController:
+    """
+    Limits the graph runs in progress, further requests wait in a bounded
+    priority queue and are rejected once it is full or they waited too long.
+
+    A full queue makes room for a request by rejecting the newest queued
+    request of a lower priority, if there is one.
+
+    Parameters
+    ----------
+    max_concurrency : int
+        The maximum number of admitted requests at a time.
+    max_queue : int
+        The maximum number of waiting requests.
+    max_wait : float
+        Seconds a request waits in the queue before it is rejected.
+    """
+
+    def __init__(self, max_concurrency: int = 4, max_queue: int = 64, max_wait: float = 30.0) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.running = 0
+        # (rank, arrival, priority, future), the future is resolved when a slot is handed over.
+        # Entries leave lazily: a request which timed out, went away or was displaced has a
+        # done future and stays in the heap until it is popped or the heap is pruned
+        self._queue: List[Tuple[int, int, str, asyncio.Future]] = []
+        # the entries still waiting
+        self._waiting = 0
+        self._arrivals = itertools.count()
+        # moving average of the seconds a slot is held, for Retry-After
+        self._service_time = 1.0
+
+    @property
+    def queued(self) -> int:
+        return self._waiting
+
+    def retry_after(self) -> int:
+        """seconds until the queue is likely drained"""
+        return max(1, math.ceil((self._waiting + 1) * self._service_time / max(self.max_concurrency, 1)))
+
+    def _reject(self, reason: str, priority: str) -> Rejected:
+        ADMISSION_REJECTED.inc(1, priority, reason)
+        return Rejected(reason, self.retry_after())
+
+    def _left(self) -> None:
+        """an entry stopped waiting, drop the done entries once they are the majority"""
+        self._waiting -= 1
+        if not self._waiting:
+            self._queue.clear()
+        elif len(self._queue) > 2 * self._waiting + 16:
+            self._queue = [entry for entry in self._queue if not entry[3].done()]
+            heapq.heapify(self._queue)
+
+    async def acquire(self, priority: str = "interactive") -> Ticket:
+        """
+        wait for a slot, raises `Rejected` if the request is not admitted.
+
+        Parameters
+        ----------
+        priority : str
+            One of `PRIORITIES`.
+        """
+        rank = PRIORITIES[priority]
+        start = time.perf_counter()
+        if self.running < self.max_concurrency and not self._waiting:
+            self.running += 1
+            ADMISSION_SECONDS.observe(0.0, priority)
+            return Ticket(self, 0.0)
+
+        if self._waiting >= self.max_queue:
+            # the lowest priority, and among those the newest, request
+            lowest = max((entry for entry in self._queue if not entry[3].done()), default=None)
+            if lowest is None or lowest[0] <= rank:
+                raise self._reject("queue_full", priority)
+            lowest[3].set_exception(self._reject("displaced", lowest[2]))
+            self._left()
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (rank, next(self._arrivals), priority, future))
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(future, self.max_wait)
+        except asyncio.TimeoutError:
+            # the future was cancelled, so it was neither handed a slot nor displaced
+            self._left()
+            raise self._reject("timeout", priority) from None
+        except asyncio.CancelledError:
+            if not future.done() or future.cancelled():
+                future.cancel()
+                self._left()
+            elif future.exception() is None:
+                # the slot was handed over as the client went away, pass it on
+                self._release(None)
+            raise
+
+        wait = time.perf_counter() - start
+        ADMISSION_SECONDS.observe(wait, priority)
+        return Ticket(self, wait)
+
+    def _release(self, held: Optional[float]) -> None:
+        if held is not None:
+            self._service_time = 0.9 * self._service_time + 0.1 * held
+        while self._queue:
+            future = heapq.heappop(self._queue)[3]
+            if not future.done():
+                # the slot goes to the waiting request, `running` does not change
+                future.set_result(None)
+                self._waiting -= 1
+                return
+        self.running -= 1
+
+    @asynccontextmanager
+    async def admit(self, priority: str = "interactive") -> AsyncIterator[Ticket]:
+        ticket = await self.acquire(priority)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+
+# shared by the backends of this process, they all call the same model server
+admission = AdmissionController(
+    max_concurrency=int(os.getenv("CHATBOT_MAX_CONCURRENCY", "4")),
+    max_queue=int(os.getenv("CHATBOT_MAX_QUEUE", "64")),
+    max_wait=float(os.getenv("CHATBOT_MAX_QUEUE_WAIT", "30")),
+)
+registry.gauge("chatbot_admission_running", "Admitted requests in progress.", function=lambda: admission.running)
+registry.gauge("chatbot_admission_queued", "Requests waiting for admission.", function=lambda: admission.queued)
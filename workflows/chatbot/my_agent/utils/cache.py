@@ -0,0 +1,208 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional, Sequence, Tuple
+
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize(message: BaseMessage) -> Dict[str, Any]:
+    """the parts of a message that affect the answer, ids and metadata are left out"""
+    content = message.content
+    if isinstance(content, str):
+        content = _WHITESPACE.sub(" ", content).strip()
+    normalized = {"type": message.type, "content": content}
+    tool_calls = getattr(message, "tool_calls", None)
+    if tool_calls:
+        normalized["tool_calls"] = [{"name": c["name"], "args": c["args"]} for c in tool_calls]
+    return normalized
+
+
+def bypass_requested(headers: Mapping[str, str]) -> bool:
+    """whether the request asks to skip the response cache"""
+    if headers.get("x-cache-bypass", "").lower() in ("1", "true", "yes"):
+        return True
+    return "no-cache" in headers.get("cache-control", "").lower()
+
+
+class ResponseCache:
+    """
+    Caches model responses by a hash of the normalized conversation.
+
+    The key covers the model name, the bound tool names and every message
+    sent to the model, with whitespace collapsed and message ids ignored.
+    Entries live in an LRU with a TTL, and optionally in a SQLite file shared by
+    all workers, which is only read on a memory miss. Every `purge_every` writes
+    of a process, and when the file is opened, the expired rows are deleted and
+    the file is cut down to its `max_disk_entries` newest rows.
+
+    Parameters
+    ----------
+    max_entries : int
+        The maximum number of responses kept in memory.
+    ttl : float
+        Seconds a response stays valid.
+    path : str, optional
+        The SQLite file of the on-disk tier, disabled if None.
+    max_disk_entries : int
+        The maximum number of responses kept in the SQLite file, it may be
+        exceeded by up to `purge_every` writes per process between purges.
+    purge_every : int
+        The number of writes between two purges of the SQLite file.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600.0,
+        path: Optional[str] = None,
+        max_disk_entries: int = 100_000,
+        purge_every: int = 256,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.purge_every = purge_every
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # rows deleted from the SQLite file, expired or over its size
+        self.purged = 0
+        self._writes = 0
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        if path:
+            self._conn = self._connect()
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, expires_at REAL NOT NULL, message TEXT NOT NULL)"
+            )
+            # the purge finds the expired and the oldest rows without a table scan
+            self._conn.execute("CREATE INDEX IF NOT EXISTS responses_expires_at ON responses (expires_at)")
+            self._purge()
+            # a connection must not cross a fork, each process opens its own
+            os.register_at_fork(
+                before=self._before_fork,
+                after_in_parent=self._after_fork,
+                after_in_child=self._after_fork,
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _before_fork(self) -> None:
+        self._lock.acquire()
+        self._conn.close()
+
+    def _after_fork(self) -> None:
+        self._conn = self._connect()
+        self._lock.release()
+
+    def _purge(self) -> None:
+        """delete the expired rows, then the oldest ones over `max_disk_entries`"""
+        deleted = self._conn.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),)).rowcount
+        over = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.max_disk_entries
+        if over > 0:
+            # every row lives `ttl` seconds, the first to expire are the oldest
+            deleted += self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses ORDER BY expires_at LIMIT ?)",
+                (over,),
+            ).rowcount
+        self.purged += deleted
+
+    @staticmethod
+    def key(messages: Sequence[BaseMessage], model_name: str, tools: Sequence[str] = ()) -> str:
+        payload = json.dumps(
+            {"model": model_name, "tools": sorted(tools), "messages": [_normalize(m) for m in messages]},
+            sort_keys=True, ensure_ascii=False, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _restore(stored: Dict[str, Any]) -> BaseMessage:
+        message = messages_from_dict([stored])[0]
+        # a fresh id, otherwise add_messages would replace the earlier answer
+        message.id = None
+        return message
+
+    def get(self, key: str) -> Optional[BaseMessage]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._restore(entry[1])
+            if entry is not None:
+                del self._entries[key]
+
+            if self._conn is not None:
+                row = self._conn.execute(
+                    "SELECT expires_at, message FROM responses WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row is not None:
+                    stored = json.loads(row[1])
+                    self._remember(key, row[0], stored)
+                    self.disk_hits += 1
+                    return self._restore(stored)
+
+            self.misses += 1
+            return None
+
+    def _remember(self, key: str, expires_at: float, stored: Dict[str, Any]) -> None:
+        self._entries[key] = (expires_at, stored)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key: str, message: BaseMessage) -> None:
+        if not message.content and not getattr(message, "tool_calls", None):
+            return
+        stored = message_to_dict(message)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, stored)
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+                    (key, expires_at, json.dumps(stored, ensure_ascii=False)),
+                )
+                self._writes += 1
+                if self._writes % self.purge_every == 0:
+                    self._purge()
+
+    async def aget(self, key: str) -> Optional[BaseMessage]:
+        if self._conn is None:
+            return self.get(key)
+        return await asyncio.to_thread(self.get, key)
+
+    async def aput(self, key: str, message: BaseMessage) -> None:
+        if self._conn is None:
+            return self.put(key, message)
+        await asyncio.to_thread(self.put, key, message)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "purged": self.purged,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+        }
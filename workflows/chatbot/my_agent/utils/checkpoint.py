@@ -0,0 +1,1022 @@
+import os
+import time
+import heapq
+import queue
+import atexit
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+)
+from langgraph.checkpoint.memory import InMemorySaver
+
+from .serde import MessageDeltaCodec, shared_prefix
+
+logger = logging.getLogger(__name__)
+
+# channel of the pending writes recorded by `interrupt()`
+INTERRUPT = "__interrupt__"
+
+
+def _typed_size(typed: Any) -> int:
+    """size of a `(type, bytes)` pair produced by `serde.dumps_typed`"""
+    return len(typed[1]) if typed and typed[1] else 0
+
+
+class BoundedInMemorySaver(InMemorySaver):
+    """
+    An InMemorySaver that keeps memory bounded by evicting whole threads.
+
+    Threads are evicted in least-recently-used order once `max_threads` or
+    `max_bytes` is exceeded, and threads idle for longer than `ttl` seconds
+    are dropped on the next write or by `hibernate_idle`.
+
+    Parameters
+    ----------
+    max_threads : int, optional
+        The maximum number of threads kept in memory.
+    max_bytes : int, optional
+        The maximum size of serialized checkpoints, writes and channel values.
+    ttl : float, optional
+        Seconds a thread can stay idle before it is evicted.
+    delta_channels : Sequence[str]
+        Channels holding message lists, each version of them only stores the
+        messages changed since the previous version (see `MessageDeltaCodec`).
+    snapshot_every : int, optional
+        A full snapshot is stored after this many deltas, which bounds the work
+        needed to rebuild a version that is not cached. None never snapshots.
+    compress : bool
+        Whether to zlib-compress the stored message deltas.
+    keep_last : int, optional
+        Retention used by `compact`, the number of checkpoints kept per thread and
+        namespace. Checkpoints waiting on an interrupt are always kept. None keeps all.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_threads: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        delta_channels: Sequence[str] = ("messages",),
+        snapshot_every: Optional[int] = 32,
+        compress: bool = True,
+        keep_last: Optional[int] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        if keep_last is not None and keep_last < 1:
+            raise ValueError("keep_last must be at least 1")
+        self.keep_last = keep_last
+        self.max_threads = max_threads
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.delta_channels = set(delta_channels)
+        self.snapshot_every = snapshot_every
+        self.total_bytes = 0
+        self.evicted_threads = 0
+        # bumped whenever a thread is added or removed, e.g. for an ETag of the thread list
+        self.threads_version = 0
+        self._codec = MessageDeltaCodec(self.serde, compress=compress)
+        # thread_id -> (checkpoint_ns, channel) -> (version, messages, deltas since snapshot),
+        # the newest decoded message list of each delta channel
+        self._latest_messages: Dict[str, Dict[Tuple[str, str], Tuple[Any, List[Any], int]]] = {}
+
+        self._lock = threading.RLock()
+        # thread_id -> last access time, ordered from least to most recently used
+        self._last_access: "OrderedDict[str, float]" = OrderedDict()
+        self._thread_bytes: Dict[str, int] = {}
+        # keys of `self.writes` and `self.blobs` owned by each thread,
+        # so that evicting a thread does not scan the whole store
+        self._write_keys: Dict[str, Set[Tuple[str, str, str]]] = {}
+        self._blob_keys: Dict[str, Set[Tuple[str, str, str, Any]]] = {}
+
+    def _touch(self, thread_id: str) -> None:
+        self._last_access[thread_id] = time.monotonic()
+        self._last_access.move_to_end(thread_id)
+
+    def _account(self, thread_id: str, nbytes: int) -> None:
+        self._thread_bytes[thread_id] = self._thread_bytes.get(thread_id, 0) + nbytes
+        self.total_bytes += nbytes
+
+    def _over_limit(self) -> bool:
+        if self.max_threads is not None and len(self._last_access) > self.max_threads:
+            return True
+        if self.max_bytes is not None and self.total_bytes > self.max_bytes:
+            return True
+        return False
+
+    def _evict_idle(self, keep: Optional[str] = None) -> int:
+        evicted = 0
+        if self.ttl is not None:
+            deadline = time.monotonic() - self.ttl
+            for thread_id, last_access in list(self._last_access.items()):
+                if last_access > deadline:
+                    break
+                if thread_id != keep:
+                    self.evict_thread(thread_id)
+                    evicted += 1
+        return evicted
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        """evict expired threads, then least recently used ones until under the limits"""
+        self._evict_idle(keep)
+        while self._over_limit():
+            thread_id = next(iter(self._last_access))
+            if thread_id == keep:
+                # the thread being written is the only one left
+                break
+            self.evict_thread(thread_id)
+
+    def evict_thread(self, thread_id: str) -> None:
+        """drop a thread from memory, subclasses may persist it first"""
+        with self._lock:
+            self._forget(thread_id)
+            self.evicted_threads += 1
+
+    def hibernate_idle(self) -> int:
+        """
+        evict the threads idle for longer than `ttl` without waiting for a write,
+        returns their number
+        """
+        with self._lock:
+            return self._evict_idle()
+
+    def memory_stats(self) -> Dict[str, Any]:
+        """the threads and checkpoint bytes held in memory, and their limits"""
+        with self._lock:
+            return {
+                "loaded_threads": len(self._last_access),
+                "max_threads": self.max_threads,
+                "checkpoint_bytes": self.total_bytes,
+                "max_checkpoint_bytes": self.max_bytes,
+                "idle_ttl": self.ttl,
+                "evicted_threads": self.evicted_threads,
+            }
+
+    def has_thread(self, thread_id: str) -> bool:
+        return thread_id in self._last_access
+
+    def list_threads(self, after: Optional[str] = None, limit: Optional[int] = None) -> List[str]:
+        """
+        thread ids held in memory in sorted order.
+
+        Parameters
+        ----------
+        after : str, optional
+            Only list the thread ids sorting after this one, the cursor of the next page.
+        limit : int, optional
+            The maximum number of thread ids.
+        """
+        with self._lock:
+            thread_ids = [t for t in self._last_access if after is None or t > after]
+        if limit is None:
+            return sorted(thread_ids)
+        return heapq.nsmallest(limit, thread_ids)
+
+    def latest_checkpoint_id(self, thread_id: str, checkpoint_ns: str = "") -> Optional[str]:
+        """id of the newest checkpoint of a thread, without decoding it"""
+        with self._lock:
+            # `self.storage` is a defaultdict, unknown threads must not be added
+            if thread_id not in self.storage:
+                return None
+            checkpoints = self.storage[thread_id].get(checkpoint_ns)
+            return max(checkpoints) if checkpoints else None
+
+    def thread_size(self, thread_id: str) -> int:
+        """serialized size of a thread in bytes"""
+        return self._thread_bytes.get(thread_id, 0)
+
+    def _encode_messages(
+        self, thread_id: str, checkpoint_ns: str, channel: str, version: Any, messages: Any
+    ) -> Tuple[str, bytes]:
+        if not isinstance(messages, list):
+            return self.serde.dumps_typed(messages)
+
+        latest = self._latest_messages.setdefault(thread_id, {})
+        cached = latest.get((checkpoint_ns, channel))
+        if cached is not None and (self.snapshot_every is None or cached[2] < self.snapshot_every):
+            base_version, base_messages, depth = cached
+            skip = shared_prefix(base_messages, messages)
+            typed = self._codec.encode(messages, base_version, skip)
+            depth += 1
+        else:
+            typed = self._codec.encode(messages)
+            depth = 0
+        latest[(checkpoint_ns, channel)] = (version, list(messages), depth)
+        return typed
+
+    def _decode_messages(
+        self, thread_id: str, checkpoint_ns: str, channel: str, version: Any
+    ) -> List[Any]:
+        latest = self._latest_messages.setdefault(thread_id, {})
+        cached = latest.get((checkpoint_ns, channel))
+        if cached is not None and cached[0] == version:
+            return list(cached[1])
+
+        # walk the base versions back to a snapshot or to the cached version
+        deltas = []
+        base = version
+        messages: List[Any] = []
+        depth = 0
+        while base is not None:
+            if cached is not None and cached[0] == base:
+                messages = list(cached[1])
+                depth = cached[2]
+                break
+            typed = self.blobs[(thread_id, checkpoint_ns, channel, base)]
+            if not self._codec.is_delta(typed):
+                messages = self.serde.loads_typed(typed)
+                break
+            base, skip, tail = self._codec.decode(typed)
+            deltas.append((skip, tail))
+
+        for skip, tail in reversed(deltas):
+            messages = messages[:skip] + tail
+
+        if cached is None or version > cached[0]:
+            # later writes are encoded against the newest version
+            latest[(checkpoint_ns, channel)] = (version, messages, depth + len(deltas))
+            return list(messages)
+        return messages
+
+    def _load_blobs(
+        self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions
+    ) -> Dict[str, Any]:
+        delta_versions = {
+            k: v for k, v in versions.items()
+            if k in self.delta_channels
+            and self._codec.is_delta(self.blobs.get((thread_id, checkpoint_ns, k, v), ("empty", b"")))
+        }
+        result = super()._load_blobs(
+            thread_id, checkpoint_ns, {k: v for k, v in versions.items() if k not in delta_versions}
+        )
+        for k, v in delta_versions.items():
+            result[k] = self._decode_messages(thread_id, checkpoint_ns, k, v)
+        return result
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            if thread_id not in self._last_access:
+                # avoid creating empty entries in the defaultdict for unknown threads
+                if thread_id not in self.storage:
+                    return None
+            else:
+                self._touch(thread_id)
+            return super().get_tuple(config)
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            if thread_id not in self.storage:
+                self.threads_version += 1
+            saved = self.storage.get(thread_id, {}).get(checkpoint_ns, {}).get(checkpoint["id"])
+            nbytes = -(_typed_size(saved[0]) + _typed_size(saved[1])) if saved else 0
+
+            # message lists are encoded here as deltas instead of full copies
+            values = checkpoint["channel_values"]
+            delta_values = {
+                k: values[k] for k in new_versions if k in self.delta_channels and k in values
+            }
+            if delta_values:
+                checkpoint = {
+                    **checkpoint,
+                    "channel_values": {k: v for k, v in values.items() if k not in delta_values},
+                }
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+            for k, v in delta_values.items():
+                self.blobs[(thread_id, checkpoint_ns, k, new_versions[k])] = self._encode_messages(
+                    thread_id, checkpoint_ns, k, new_versions[k], v
+                )
+
+            saved = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+            nbytes += _typed_size(saved[0]) + _typed_size(saved[1])
+            blob_keys = self._blob_keys.setdefault(thread_id, set())
+            for k, v in new_versions.items():
+                key = (thread_id, checkpoint_ns, k, v)
+                if key not in blob_keys:
+                    blob_keys.add(key)
+                    nbytes += _typed_size(self.blobs[key])
+
+            self._account(thread_id, nbytes)
+            self._touch(thread_id)
+            self._evict(keep=thread_id)
+        return next_config
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        outer_key = (thread_id, checkpoint_ns, checkpoint_id)
+        with self._lock:
+            before = self.writes.get(outer_key, {})
+            nbytes = -sum(_typed_size(w[2]) for w in before.values())
+
+            super().put_writes(config, writes, task_id, task_path)
+
+            nbytes += sum(_typed_size(w[2]) for w in self.writes.get(outer_key, {}).values())
+            self._write_keys.setdefault(thread_id, set()).add(outer_key)
+            self._account(thread_id, nbytes)
+            self._touch(thread_id)
+
+    def _forget(self, thread_id: str) -> None:
+        """remove a thread from the in-memory store"""
+        self._latest_messages.pop(thread_id, None)
+        self.threads_version += 1
+        if thread_id not in self._last_access:
+            super().delete_thread(thread_id)
+            return
+
+        self.storage.pop(thread_id, None)
+        for key in self._write_keys.pop(thread_id, ()):
+            self.writes.pop(key, None)
+        for key in self._blob_keys.pop(thread_id, ()):
+            self.blobs.pop(key, None)
+        self.total_bytes -= self._thread_bytes.pop(thread_id, 0)
+        del self._last_access[thread_id]
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._forget(thread_id)
+
+    def _pending_interrupt(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> bool:
+        writes = self.writes.get((thread_id, checkpoint_ns, checkpoint_id), {})
+        return any(w[1] == INTERRUPT for w in writes.values())
+
+    def _compact(self, thread_id: str, keep_last: int) -> Dict[str, Any]:
+        """
+        drop the checkpoints of a thread beyond the newest `keep_last` ones,
+        must be called with `self._lock` held.
+        """
+        changes: Dict[str, Any] = {
+            "dropped_checkpoints": [],
+            "dropped_blobs": [],
+            "rewritten_blobs": [],
+            "reparented": [],
+            "reclaimed_bytes": 0,
+        }
+        nbytes = 0
+        for checkpoint_ns, checkpoints in self.storage.get(thread_id, {}).items():
+            if len(checkpoints) <= keep_last:
+                continue
+
+            ids = sorted(checkpoints)
+            keep = set(ids[-keep_last:])
+            # a checkpoint without children that waits on an interrupt can still be resumed
+            parents = {entry[2] for entry in checkpoints.values()}
+            keep.update(
+                cid for cid in ids
+                if cid not in parents and self._pending_interrupt(thread_id, checkpoint_ns, cid)
+            )
+            drop = [cid for cid in ids if cid not in keep]
+            if not drop:
+                continue
+
+            referenced = set()
+            for cid in keep:
+                checkpoint = self.serde.loads_typed(checkpoints[cid][0])
+                referenced.update(
+                    (thread_id, checkpoint_ns, ch, v)
+                    for ch, v in checkpoint["channel_versions"].items()
+                )
+
+            # message deltas based on a dropped version are rewritten as snapshots,
+            # all of them are decoded before anything is removed
+            rewritten = {}
+            for key in sorted(k for k in referenced if k in self.blobs):
+                typed = self.blobs[key]
+                if not self._codec.is_delta(typed):
+                    continue
+                base, _, _ = self._codec.decode(typed)
+                if base is not None and (thread_id, checkpoint_ns, key[2], base) not in referenced:
+                    messages = self._decode_messages(thread_id, checkpoint_ns, key[2], key[3])
+                    rewritten[key] = self._codec.encode(messages)
+            for key, typed in rewritten.items():
+                nbytes += _typed_size(self.blobs[key]) - _typed_size(typed)
+                self.blobs[key] = typed
+                changes["rewritten_blobs"].append(key)
+
+            for cid in drop:
+                checkpoint, metadata, _ = checkpoints.pop(cid)
+                nbytes += _typed_size(checkpoint) + _typed_size(metadata)
+                write_key = (thread_id, checkpoint_ns, cid)
+                writes = self.writes.pop(write_key, {})
+                nbytes += sum(_typed_size(w[2]) for w in writes.values())
+                self._write_keys.get(thread_id, set()).discard(write_key)
+                changes["dropped_checkpoints"].append((checkpoint_ns, cid))
+
+            blob_keys = self._blob_keys.get(thread_id, set())
+            for key in [k for k in blob_keys if k[1] == checkpoint_ns and k not in referenced]:
+                nbytes += _typed_size(self.blobs.pop(key, None))
+                blob_keys.discard(key)
+                changes["dropped_blobs"].append(key)
+
+            for cid in keep:
+                checkpoint, metadata, parent = checkpoints[cid]
+                if parent is not None and parent not in checkpoints:
+                    checkpoints[cid] = (checkpoint, metadata, None)
+                    changes["reparented"].append((checkpoint_ns, cid))
+
+        self._account(thread_id, -nbytes)
+        changes["reclaimed_bytes"] = nbytes
+        return changes
+
+    def compact(self, keep_last: Optional[int] = None) -> Dict[str, Any]:
+        """
+        apply the retention policy to every thread held in memory.
+
+        The lock is only held while a single thread is compacted, so graph runs
+        on other threads are not blocked for the whole pass.
+
+        Parameters
+        ----------
+        keep_last : int, optional
+            Overrides `self.keep_last` for this pass.
+
+        Returns
+        -------
+        report : Dict[str, Any]
+            The number of threads visited and checkpoints dropped, the reclaimed
+            bytes and how long the pass took.
+        """
+        keep_last = keep_last if keep_last is not None else self.keep_last
+        start = time.perf_counter()
+        report = {"threads": 0, "dropped_checkpoints": 0, "reclaimed_bytes": 0}
+        if keep_last is not None:
+            with self._lock:
+                thread_ids = list(self._last_access)
+            for thread_id in thread_ids:
+                with self._lock:
+                    if thread_id not in self._last_access:
+                        continue
+                    changes = self._compact(thread_id, keep_last)
+                report["threads"] += 1
+                report["dropped_checkpoints"] += len(changes["dropped_checkpoints"])
+                report["reclaimed_bytes"] += changes["reclaimed_bytes"]
+        report["duration_ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return report
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    version NOT NULL,
+    type TEXT,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL,
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+class WriteBehindSqliteSaver(BoundedInMemorySaver):
+    """
+    A durable checkpointer backed by a local SQLite database.
+
+    Reads and writes are served from the in-memory store, every write is also
+    queued for a background thread which commits the queue to SQLite in batches.
+    The database runs in WAL mode with `synchronous=NORMAL`, so a graph step never
+    waits for SQLite or an fsync. On a crash at most the last `flush_interval`
+    seconds of writes are lost.
+
+    Threads evicted from memory stay on disk and are loaded back on the next access,
+    so `max_threads`, `max_bytes` and `ttl` only bound the memory usage: idle
+    threads hibernate on disk and memory grows with the active threads only.
+    With `keep_last` set, a thread is compacted before it is evicted, so the
+    retention also holds for the threads on disk.
+
+    The database and the writer thread are opened on first use, creating the
+    saver has no side effects. A read waits for the queued rows of its thread
+    without holding the lock, and the async methods run in a worker thread, so
+    neither a slow batch nor a read from disk blocks the event loop.
+
+    Parameters
+    ----------
+    path : str
+        The path of the SQLite database file.
+    flush_interval : float
+        Seconds the writer waits to collect a batch before committing it.
+    max_batch : int
+        The maximum number of rows committed in one transaction.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        flush_interval: float = 0.05,
+        max_batch: int = 512,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        # reads only happen when a thread is not in memory, guarded by `self._lock`,
+        # the connection and the writer are started by `_open`
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writer: Optional[threading.Thread] = None
+        self._queue: "queue.Queue[Optional[Tuple[str, str, tuple]]]" = queue.Queue()
+        # number of queued rows per thread, a thread without queued rows
+        # can be read from SQLite without waiting for the writer
+        self._queued: Dict[str, int] = {}
+        self._queued_lock = threading.Lock()
+        # notified by the writer whenever it committed a batch
+        self._written = threading.Condition(self._queued_lock)
+        # threads loaded back from disk, and the seconds spent loading them
+        self.rehydrated_threads = 0
+        self.rehydrate_seconds = 0.0
+        self._closed = False
+        # whether `_before_fork` stopped the writer, so `_after_fork` restarts it
+        self._fork_stopped = False
+        # neither the connection nor the writer may cross a fork, e.g. of the
+        # preloading master in `backend/serve.py`, both are reopened after it
+        os.register_at_fork(
+            before=self._before_fork,
+            after_in_parent=self._after_fork,
+            after_in_child=self._after_fork,
+        )
+
+    def _open(self) -> sqlite3.Connection:
+        """the connection for reads, connecting and starting the writer on first use"""
+        with self._lock:
+            if self._conn is None:
+                self._conn = self._connect()
+                self._conn.executescript(_SCHEMA)
+                self._start_writer()
+                atexit.register(self.close)
+            return self._conn
+
+    def _start_writer(self) -> None:
+        self._writer = threading.Thread(
+            target=self._write_loop, name="checkpoint-writer", daemon=True
+        )
+        self._writer.start()
+
+    def _before_fork(self) -> None:
+        if self._closed or self._conn is None:
+            return
+        self._lock.acquire()
+        self._fork_stopped = True
+        # commits the queue, so no row is written twice
+        self._queue.put(None)
+        self._writer.join()
+        self._conn.close()
+
+    def _after_fork(self) -> None:
+        if not self._fork_stopped:
+            return
+        self._fork_stopped = False
+        self._conn = self._connect()
+        self._start_writer()
+        self._lock.release()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _enqueue(self, thread_id: str, sql: str, params: tuple) -> None:
+        self._open()
+        with self._queued_lock:
+            self._queued[thread_id] = self._queued.get(thread_id, 0) + 1
+        self._queue.put((thread_id, sql, params))
+
+    def _write_loop(self) -> None:
+        conn = self._connect()
+        stopped = False
+        while not stopped:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch and batch[-1] is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            stopped = batch[-1] is None
+            rows = [item for item in batch if item is not None]
+            try:
+                if rows:
+                    conn.execute("BEGIN")
+                    for _, sql, params in rows:
+                        conn.execute(sql, params)
+                    conn.execute("COMMIT")
+            except Exception:
+                logger.exception("failed to write %d checkpoint rows", len(rows))
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+            finally:
+                with self._queued_lock:
+                    for thread_id, _, _ in rows:
+                        self._queued[thread_id] -= 1
+                        if not self._queued[thread_id]:
+                            del self._queued[thread_id]
+                    self._written.notify_all()
+                for _ in batch:
+                    self._queue.task_done()
+        conn.close()
+
+    def flush(self) -> None:
+        """block until every queued write is committed"""
+        self._queue.join()
+
+    def _stale(self, thread_ids: Optional[Iterable[str]]) -> List[str]:
+        """the threads, all if None, which are not in memory and have rows queued"""
+        with self._queued_lock:
+            queued = list(self._queued) if thread_ids is None else [t for t in thread_ids if t in self._queued]
+        return [t for t in queued if t not in self._last_access]
+
+    @contextmanager
+    def _locked(self, thread_ids: Optional[Iterable[str]] = None) -> Iterator[None]:
+        """
+        hold `self._lock` with the threads, all if None, readable from SQLite: every
+        thread is in memory or has no rows queued. The writer is waited for without
+        holding the lock, so other threads are not blocked meanwhile.
+        """
+        thread_ids = None if thread_ids is None else list(thread_ids)
+        while True:
+            stale = self._stale(thread_ids)
+            if stale:
+                with self._written:
+                    self._written.wait_for(lambda: not any(t in self._queued for t in stale))
+            self._lock.acquire()
+            # a thread may have been evicted, or deleted, meanwhile
+            if not self._stale(thread_ids):
+                break
+            self._lock.release()
+        try:
+            yield
+        finally:
+            self._lock.release()
+
+    def close(self) -> None:
+        """commit the queued writes and stop the writer thread"""
+        self._closed = True
+        if self._writer is not None and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        atexit.unregister(self.close)
+
+    def _load_thread(self, thread_id: str) -> None:
+        """
+        load a thread from SQLite into memory if it is not there yet,
+        must be called within `self._locked([thread_id])`
+        """
+        if thread_id in self._last_access:
+            return
+        start = time.perf_counter()
+
+        nbytes = 0
+        rows = self._open().execute(
+            "SELECT checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+            "metadata_type, metadata FROM checkpoints WHERE thread_id = ?",
+            (thread_id,),
+        ).fetchall()
+        if not rows:
+            return
+        for ns, checkpoint_id, parent_id, type_, checkpoint, metadata_type, metadata in rows:
+            self.storage[thread_id][ns][checkpoint_id] = (
+                (type_, checkpoint), (metadata_type, metadata), parent_id
+            )
+            nbytes += len(checkpoint or b"") + len(metadata or b"")
+
+        blob_keys = self._blob_keys.setdefault(thread_id, set())
+        for ns, channel, version, type_, blob in self._open().execute(
+            "SELECT checkpoint_ns, channel, version, type, blob FROM blobs WHERE thread_id = ?",
+            (thread_id,),
+        ):
+            key = (thread_id, ns, channel, version)
+            self.blobs[key] = (type_, blob)
+            blob_keys.add(key)
+            nbytes += len(blob or b"")
+
+        write_keys = self._write_keys.setdefault(thread_id, set())
+        for ns, checkpoint_id, task_id, idx, channel, type_, value, task_path in self._open().execute(
+            "SELECT checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path "
+            "FROM writes WHERE thread_id = ?",
+            (thread_id,),
+        ):
+            key = (thread_id, ns, checkpoint_id)
+            self.writes[key][(task_id, idx)] = (task_id, channel, (type_, value), task_path)
+            write_keys.add(key)
+            nbytes += len(value or b"")
+
+        self._account(thread_id, nbytes)
+        self._touch(thread_id)
+        self._evict(keep=thread_id)
+        self.rehydrated_threads += 1
+        self.rehydrate_seconds += time.perf_counter() - start
+
+    def evict_thread(self, thread_id: str) -> None:
+        with self._lock:
+            # the thread stays on disk, the thread list does not change
+            version = self.threads_version
+            if self.keep_last is not None and thread_id in self._last_access:
+                # the compactor only visits threads in memory
+                self._compact(thread_id, self.keep_last)
+            super().evict_thread(thread_id)
+            self.threads_version = version
+
+    def memory_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **super().memory_stats(),
+                "rehydrated_threads": self.rehydrated_threads,
+                "rehydrate_seconds": round(self.rehydrate_seconds, 6),
+                "queued_rows": self._queue.qsize(),
+            }
+
+    def has_thread(self, thread_id: str) -> bool:
+        with self._locked([thread_id]):
+            if thread_id in self._last_access:
+                return True
+            row = self._open().execute(
+                "SELECT 1 FROM checkpoints WHERE thread_id = ? LIMIT 1", (thread_id,)
+            ).fetchone()
+            return row is not None
+
+    def list_threads(self, after: Optional[str] = None, limit: Optional[int] = None) -> List[str]:
+        """thread ids stored on disk or in memory in sorted order, see `BoundedInMemorySaver.list_threads`"""
+        with self._locked():
+            # served by the primary key index, one page at a time
+            stored = [
+                row[0] for row in self._open().execute(
+                    "SELECT DISTINCT thread_id FROM checkpoints WHERE thread_id > ? "
+                    "ORDER BY thread_id LIMIT ?",
+                    (after if after is not None else "", limit if limit is not None else -1),
+                )
+            ]
+            in_memory = super().list_threads(after, limit)
+        thread_ids = sorted(set(stored).union(in_memory))
+        return thread_ids if limit is None else thread_ids[:limit]
+
+    def latest_checkpoint_id(self, thread_id: str, checkpoint_ns: str = "") -> Optional[str]:
+        with self._locked([thread_id]):
+            if thread_id in self._last_access:
+                return super().latest_checkpoint_id(thread_id, checkpoint_ns)
+            # served by the primary key index, the thread is not loaded
+            row = self._open().execute(
+                "SELECT MAX(checkpoint_id) FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, checkpoint_ns),
+            ).fetchone()
+            return row[0]
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        with self._locked([thread_id]):
+            self._load_thread(thread_id)
+            return super().get_tuple(config)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        # listing without a thread loads every stored thread
+        thread_ids = [config["configurable"]["thread_id"]] if config else self.list_threads()
+        with self._locked(thread_ids):
+            for thread_id in thread_ids:
+                self._load_thread(thread_id)
+            items = list(super().list(config, filter=filter, before=before, limit=limit))
+        yield from items
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._locked([thread_id]):
+            self._load_thread(thread_id)
+            next_config = super().put(config, checkpoint, metadata, new_versions)
+
+            # queue the rows already serialized by the in-memory store
+            saved = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+            for k, v in new_versions.items():
+                type_, blob = self.blobs[(thread_id, checkpoint_ns, k, v)]
+                self._enqueue(
+                    thread_id,
+                    "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, k, v, type_, blob),
+                )
+            self._enqueue(
+                thread_id,
+                "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id, checkpoint_ns, checkpoint["id"], saved[2],
+                    saved[0][0], saved[0][1], saved[1][0], saved[1][1],
+                ),
+            )
+        return next_config
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        outer_key = (thread_id, checkpoint_ns, checkpoint_id)
+        with self._locked([thread_id]):
+            self._load_thread(thread_id)
+            super().put_writes(config, writes, task_id, task_path)
+
+            for (write_task_id, idx), (_, channel, (type_, value), path) in self.writes[outer_key].items():
+                if write_task_id != task_id:
+                    continue
+                self._enqueue(
+                    thread_id,
+                    "INSERT OR REPLACE INTO writes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type_, value, path),
+                )
+
+    def _compact(self, thread_id: str, keep_last: int) -> Dict[str, Any]:
+        changes = super()._compact(thread_id, keep_last)
+        for checkpoint_ns, checkpoint_id in changes["dropped_checkpoints"]:
+            for table in ("checkpoints", "writes"):
+                self._enqueue(
+                    thread_id,
+                    f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                )
+        for key in changes["dropped_blobs"]:
+            self._enqueue(
+                thread_id,
+                "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                key,
+            )
+        for key in changes["rewritten_blobs"]:
+            self._enqueue(
+                thread_id,
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, *self.blobs[key]),
+            )
+        for checkpoint_ns, checkpoint_id in changes["reparented"]:
+            self._enqueue(
+                thread_id,
+                "UPDATE checkpoints SET parent_checkpoint_id = NULL "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                (thread_id, checkpoint_ns, checkpoint_id),
+            )
+        return changes
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._forget(thread_id)
+            for table in ("checkpoints", "blobs", "writes"):
+                self._enqueue(thread_id, f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+    # the async methods of InMemorySaver call the sync ones on the event loop
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+class CheckpointCompactor:
+    """
+    Runs `saver.hibernate_idle()` and `saver.compact()` periodically in a daemon thread.
+
+    Compaction decodes and re-encodes checkpoints, running it off the event loop
+    keeps it from delaying request handling. Idle threads leave memory on the
+    next pass, also when no other conversation writes.
+
+    Parameters
+    ----------
+    saver : BoundedInMemorySaver
+        The checkpointer to compact.
+    interval : float
+        Seconds between two compaction passes.
+    """
+
+    def __init__(self, saver: BoundedInMemorySaver, interval: float = 60.0) -> None:
+        self.saver = saver
+        self.interval = interval
+        self.last_report: Optional[Dict[str, Any]] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name="checkpoint-compactor", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                hibernated = self.saver.hibernate_idle()
+                if hibernated:
+                    logger.info("hibernated %d idle threads", hibernated)
+                self.last_report = self.saver.compact()
+            except Exception:
+                logger.exception("checkpoint compaction failed")
+                continue
+            if self.last_report["dropped_checkpoints"]:
+                logger.info(
+                    "compacted %(threads)d threads: dropped %(dropped_checkpoints)d checkpoints, "
+                    "reclaimed %(reclaimed_bytes)d bytes in %(duration_ms).1f ms",
+                    self.last_report,
+                )
@@ -0,0 +1,169 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+from .state import State
+from .models import DEFAULT_MODEL, get_model
+
+SUMMARY_PROMPT = (
+    "You maintain the running summary of a conversation between a user and an assistant. "
+    "Merge the previous summary and the new messages into one concise summary. "
+    "Keep facts, decisions, user preferences and open questions, drop small talk. "
+    "Answer with the summary only."
+)
+
+
+def approx_tokens(text: str) -> int:
+    """
+    a cheap token estimate that does not need the model tokenizer.
+
+    Latin text is about 4 characters per token, CJK characters are mostly
+    one token each.
+    """
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class ContextWindow:
+    """
+    Keeps the prompt sent to the model under a token budget.
+
+    Messages stay in the graph state. Once the messages after the last cut exceed
+    `max_tokens`, the oldest turns are cut so that about `target_tokens` remain,
+    and the cut messages are either dropped from the prompt (`mode="trim"`) or
+    merged into a running summary (`mode="summarize"`). The cut position and
+    summary are stored in the `summarized_until` and `summary` state keys.
+
+    Token counts are cached by message id, so a turn only counts its new messages.
+
+    Parameters
+    ----------
+    max_tokens : int
+        The budget of the summary plus the messages sent to the model.
+    target_tokens : int, optional
+        The size the context is cut down to, half of `max_tokens` by default,
+        so that cutting (and summarizing) happens once every few turns.
+    mode : str
+        `"trim"` or `"summarize"`.
+    model_name : str
+        The model used to write summaries.
+    count_tokens : Callable[[str], int]
+        The token counter, `approx_tokens` by default.
+    cache_size : int
+        The number of message token counts kept in the cache.
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        target_tokens: Optional[int] = None,
+        mode: str = "summarize",
+        model_name: str = DEFAULT_MODEL,
+        count_tokens: Callable[[str], int] = approx_tokens,
+        cache_size: int = 100_000,
+    ) -> None:
+        if mode not in ("trim", "summarize"):
+            raise ValueError(f"Unsupported context mode: {mode}")
+        self.max_tokens = max_tokens
+        self.target_tokens = target_tokens if target_tokens is not None else max_tokens // 2
+        self.mode = mode
+        self.model_name = model_name
+        self.count_tokens = count_tokens
+        self.cache_size = cache_size
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, message: BaseMessage) -> int:
+        """token count of a message, cached by message id"""
+        if message.id is not None:
+            with self._lock:
+                n = self._counts.get(message.id)
+                if n is not None:
+                    self._counts.move_to_end(message.id)
+                    return n
+
+        # a few extra tokens for the role and message separators
+        n = self.count_tokens(str(message.content)) + 4
+        if message.id is not None:
+            with self._lock:
+                self._counts[message.id] = n
+                if len(self._counts) > self.cache_size:
+                    self._counts.popitem(last=False)
+        return n
+
+    @staticmethod
+    def _live_messages(state: State) -> Sequence[BaseMessage]:
+        """the messages after the last cut"""
+        messages = state["messages"]
+        until = state.get("summarized_until")
+        if until:
+            for i in range(len(messages) - 1, -1, -1):
+                if messages[i].id == until:
+                    return messages[i + 1:]
+        return messages
+
+    def model_input(self, state: State) -> List[BaseMessage]:
+        """the messages to send to the model: the summary and the messages after the cut"""
+        messages = list(self._live_messages(state))
+        if state.get("summary"):
+            summary = SystemMessage(content=f"Summary of the earlier conversation:\n{state['summary']}")
+            messages = [summary] + messages
+        return messages
+
+    def _cut(self, state: State) -> Optional[Sequence[BaseMessage]]:
+        """the oldest messages to cut, None if the context fits in the budget"""
+        live = self._live_messages(state)
+        counts = [self.count(m) for m in live]
+        summary_tokens = self.count_tokens(state.get("summary", ""))
+        total = summary_tokens + sum(counts)
+        if total <= self.max_tokens:
+            return None
+
+        # cut whole turns only, the first kept message must be a user message
+        cut = 0
+        for i in range(len(live) - 1):
+            if total <= self.target_tokens:
+                break
+            total -= counts[i]
+            if isinstance(live[i + 1], HumanMessage):
+                cut = i + 1
+        # the latest user message is always kept
+        last_human = max((i for i, m in enumerate(live) if isinstance(m, HumanMessage)), default=0)
+        cut = min(cut, last_human)
+        return live[:cut] if cut else None
+
+    def _summary_request(self, state: State, cut: Sequence[BaseMessage]) -> List[BaseMessage]:
+        transcript = "\n".join(f"{m.type}: {m.content}" for m in cut if m.content)
+        return [
+            SystemMessage(content=SUMMARY_PROMPT),
+            HumanMessage(
+                content=f"Previous summary:\n{state.get('summary', '')}\n\nNew messages:\n{transcript}"
+            ),
+        ]
+
+    def node(self, state: State) -> Dict[str, Any]:
+        """
+        graph node to run before the model, updates the cut and summary
+        when the context exceeds the budget.
+        """
+        cut = self._cut(state)
+        if cut is None:
+            return {}
+        update: Dict[str, Any] = {"summarized_until": cut[-1].id}
+        if self.mode == "summarize":
+            llm = get_model(self.model_name)
+            update["summary"] = llm.invoke(self._summary_request(state, cut)).content
+        return update
+
+    async def anode(self, state: State) -> Dict[str, Any]:
+        """async version of `node`"""
+        cut = self._cut(state)
+        if cut is None:
+            return {}
+        update: Dict[str, Any] = {"summarized_until": cut[-1].id}
+        if self.mode == "summarize":
+            llm = get_model(self.model_name)
+            update["summary"] = (await llm.ainvoke(self._summary_request(state, cut))).content
+        return update
@@ -0,0 +1,242 @@
+import os
+import time
+import resource
+import threading
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[Any]) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """A histogram with fixed buckets per combination of label values."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [bucket counts..., count, sum]
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[index if index < len(self.buckets) else len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        bucket_labels = self.labels + ("le",)
+        for label_values, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(bucket_labels, label_values + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_count{_labels(self.labels, label_values)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, label_values)} {counts[-1]}")
+        return lines
+
+
+class Counter:
+    """A monotonically increasing count per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values: str) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """A value which goes up and down, or is read from `function` on every scrape."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), function: Optional[Callable[[], float]] = None) -> None:
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def dec(self, amount: float = 1, *label_values: str) -> None:
+        self.inc(-amount, *label_values)
+
+    def render(self) -> List[str]:
+        if self.function is not None:
+            with self._lock:
+                self._values[()] = self.function()
+        return super().render()
+
+
+class Registry:
+    """The metrics of this process, rendered in the Prometheus text format."""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Any] = {}
+
+    def _add(self, metric: Any) -> Any:
+        return self._metrics.setdefault(metric.name, metric)
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labels, buckets))
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = (), function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._add(Gauge(name, help, labels, function))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def resident_bytes() -> int:
+    """resident memory of this process, its peak where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+registry = Registry()
+NODE_SECONDS = registry.histogram("chatbot_node_duration_seconds", "Duration of graph node runs.", ("node",))
+TOOL_SECONDS = registry.histogram("chatbot_tool_duration_seconds", "Duration of tool calls.", ("tool",))
+LLM_FIRST_TOKEN_SECONDS = registry.histogram(
+    "chatbot_llm_first_token_seconds", "Time from a model call to its first streamed token."
+)
+TIME_TO_FIRST_TOKEN_SECONDS = registry.histogram(
+    "chatbot_time_to_first_token_seconds", "Time from a request to its first token sent.", ("endpoint",)
+)
+REQUEST_SECONDS = registry.histogram("chatbot_request_duration_seconds", "Duration of chat requests.", ("endpoint",))
+QUEUE_SECONDS = registry.histogram(
+    "chatbot_queue_wait_seconds", "Time a turn waits for the previous turn of its conversation."
+)
+CHECKPOINT_SECONDS = registry.histogram(
+    "chatbot_checkpoint_write_seconds", "Duration of checkpointer writes.", ("operation",),
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0),
+)
+ADMISSION_SECONDS = registry.histogram(
+    "chatbot_admission_wait_seconds", "Time a request waits for admission.", ("priority",)
+)
+ADMISSION_REJECTED = registry.counter(
+    "chatbot_admission_rejected_total", "Requests rejected by admission control.", ("priority", "reason")
+)
+TOKENS = registry.counter("chatbot_tokens_streamed_total", "Tokens streamed by the model.")
+ACTIVE_RUNS = registry.gauge("chatbot_active_runs", "Graph runs in progress.")
+RESIDENT_BYTES = registry.gauge("chatbot_process_resident_bytes", "Resident memory of this process.", function=resident_bytes)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Records the duration of graph nodes and tools, the time to the first
+    model token and the number of streamed tokens.
+
+    The handler runs inline and only keeps a start time per run, so it can
+    stay enabled in production.
+    """
+
+    run_inline = True
+
+    def __init__(self) -> None:
+        # run id -> (histogram, label values, start time)
+        self._runs: Dict[UUID, Tuple[Histogram, Tuple[str, ...], float]] = {}
+
+    def _end(self, run_id: UUID) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            run[0].observe(time.perf_counter() - run[2], *run[1])
+
+    def on_chain_start(self, serialized: Any, inputs: Any, *, run_id: UUID,
+                       tags: Optional[List[str]] = None, metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        # node runs are tagged with their graph step, the runnables inside them are not
+        if tags and metadata and any(tag.startswith("graph:step:") for tag in tags):
+            self._runs[run_id] = (NODE_SECONDS, (metadata.get("langgraph_node", ""),), time.perf_counter())
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        name = kwargs.get("name") or (serialized or {}).get("name", "")
+        self._runs[run_id] = (TOOL_SECONDS, (name,), time.perf_counter())
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_chat_model_start(self, serialized: Any, messages: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._runs[run_id] = (LLM_FIRST_TOKEN_SECONDS, (), time.perf_counter())
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        if not token:
+            # e.g. the empty chunk closing the stream
+            return
+        TOKENS.inc()
+        # only the first token of a model call ends its run
+        self._end(run_id)
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        # not streamed, there is no first token
+        self._runs.pop(run_id, None)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._runs.pop(run_id, None)
+
+
+metrics_handler = MetricsCallbackHandler()
+
+
+def instrument_checkpointer(saver: Any) -> Any:
+    """record the duration of `put` and `put_writes` of a checkpointer instance"""
+    for operation in ("put", "put_writes"):
+        method = getattr(saver, operation)
+
+        def timed(*args: Any, _method: Callable = method, _operation: str = operation, **kwargs: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return _method(*args, **kwargs)
+            finally:
+                CHECKPOINT_SECONDS.observe(time.perf_counter() - start, _operation)
+
+        setattr(saver, operation, timed)
+    return saver
@@ -0,0 +1,137 @@
+import os
+import asyncio
+import logging
+import threading
+from contextlib import suppress
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, Optional, Sequence, Tuple
+
+import httpx
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import Runnable
+
+if TYPE_CHECKING:
+    from langchain_ollama import ChatOllama
+
+logger = logging.getLogger(__name__)
+
+# ollama model tags for each supported model name
+MODEL_TAGS = {
+    "qwen3": "qwen3:8b",
+}
+DEFAULT_MODEL = os.getenv("CHATBOT_MODEL", "qwen3")
+
+# how long ollama keeps the model loaded after the last request
+KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# connection pool shared by all graph steps in this process,
+# keep-alive connections are reused instead of reconnecting on every turn
+POOL_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32")),
+    max_keepalive_connections=int(os.getenv("OLLAMA_MAX_KEEPALIVE_CONNECTIONS", "16")),
+    keepalive_expiry=float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "60")),
+)
+
+# tool-bound variants, keyed by (model_name, tool names)
+_bound_models: Dict[Tuple[str, Tuple[str, ...]], Runnable] = {}
+_bound_lock = threading.Lock()
+
+
+@lru_cache(maxsize=4)
+def _get_model(model_name: str) -> "ChatOllama":
+    if model_name not in MODEL_TAGS:
+        raise ValueError(f"Unsupported model type: {model_name}")
+    # imported on first use, it is a third of the import time of the backends
+    from langchain_ollama import ChatOllama
+
+    return ChatOllama(
+        model=MODEL_TAGS[model_name],
+        reasoning=False,
+        keep_alive=KEEP_ALIVE,
+        client_kwargs={"limits": POOL_LIMITS},
+    )
+
+
+def _tool_name(tool: Any) -> str:
+    return getattr(tool, "name", None) or getattr(tool, "__name__", repr(tool))
+
+
+def get_model(model_name: str = DEFAULT_MODEL, tools: Sequence[Any] = ()) -> Runnable:
+    """
+    get the process-wide model instance, optionally bound with tools.
+
+    Parameters
+    ----------
+    model_name : str
+        The name of the model, must be one of `MODEL_TAGS`.
+    tools : Sequence[Any]
+        The tools to bind, the bound model is cached by the tool names.
+    """
+    model = _get_model(model_name)
+    if not tools:
+        return model
+
+    key = (model_name, tuple(_tool_name(tool) for tool in tools))
+    bound = _bound_models.get(key)
+    if bound is None:
+        with _bound_lock:
+            bound = _bound_models.get(key)
+            if bound is None:
+                bound = _bound_models[key] = model.bind_tools(tools)
+    return bound
+
+
+async def awarmup(model_name: str = DEFAULT_MODEL) -> bool:
+    """
+    load the model into ollama before the first user request arrives.
+
+    Returns True if the model answered, failures are logged but not raised
+    so that the server can still start while ollama is unavailable.
+    """
+    model = _get_model(model_name)
+    try:
+        # a single token is enough to get the weights loaded
+        await model.ainvoke([HumanMessage(content="hi")], options={"num_predict": 1})
+    except Exception as e:
+        logger.warning("failed to warm up model %s: %s", model_name, e)
+        return False
+
+    logger.info("model %s is warmed up", model_name)
+    return True
+
+
+class ModelWarmup:
+    """
+    Warms up the model in the background, retrying until it answers.
+
+    The server accepts requests while the model loads, `ready` only turns
+    True once it has answered, e.g. for a readiness probe.
+
+    Parameters
+    ----------
+    model_name : str
+        The name of the model, must be one of `MODEL_TAGS`.
+    retry_interval : float
+        Seconds between two failed warmups.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, retry_interval: float = 5.0) -> None:
+        self.model_name = model_name
+        self.retry_interval = retry_interval
+        self.ready = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while not await awarmup(self.model_name):
+            await asyncio.sleep(self.retry_interval)
+        self.ready = True
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
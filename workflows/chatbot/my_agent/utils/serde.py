@@ -0,0 +1,87 @@
+import zlib
+from typing import Any, List, Optional, Sequence, Tuple
+
+import ormsgpack
+from langgraph.checkpoint.serde.base import SerializerProtocol
+
+DELTA_TYPE = "msgdelta"
+COMPRESSED_DELTA_TYPE = "msgdelta+zlib"
+
+
+class MessageDeltaCodec:
+    """
+    Encodes a message list as the messages changed since a base version.
+
+    A delta stores the base version, how many leading messages are shared with
+    the base, and the serialized messages after them, packed with msgpack and
+    optionally compressed with zlib. A delta without base is a full snapshot.
+
+    Parameters
+    ----------
+    serde : SerializerProtocol
+        The serializer used for each message.
+    compress : bool
+        Whether to zlib-compress payloads of at least `compress_min_bytes`.
+    compress_min_bytes : int
+        Payloads smaller than this are stored uncompressed.
+    """
+
+    def __init__(
+        self,
+        serde: SerializerProtocol,
+        compress: bool = True,
+        compress_min_bytes: int = 512,
+    ) -> None:
+        self.serde = serde
+        self.compress = compress
+        self.compress_min_bytes = compress_min_bytes
+
+    @staticmethod
+    def is_delta(typed: Tuple[str, bytes]) -> bool:
+        return typed[0] in (DELTA_TYPE, COMPRESSED_DELTA_TYPE)
+
+    def encode(
+        self,
+        messages: Sequence[Any],
+        base_version: Optional[Any] = None,
+        skip: int = 0,
+    ) -> Tuple[str, bytes]:
+        """
+        encode `messages[skip:]` as a delta against `base_version`.
+
+        Parameters
+        ----------
+        messages : Sequence[Any]
+            The full message list of the new version.
+        base_version : Any, optional
+            The channel version the first `skip` messages are taken from.
+        skip : int
+            The number of leading messages shared with the base version.
+        """
+        payload = ormsgpack.packb({
+            "base": base_version,
+            "skip": skip,
+            "messages": [list(self.serde.dumps_typed(msg)) for msg in messages[skip:]],
+        })
+        if self.compress and len(payload) >= self.compress_min_bytes:
+            return COMPRESSED_DELTA_TYPE, zlib.compress(payload)
+        return DELTA_TYPE, payload
+
+    def decode(self, typed: Tuple[str, bytes]) -> Tuple[Optional[Any], int, List[Any]]:
+        """decode a delta into `(base_version, skip, messages)`"""
+        type_, data = typed
+        if type_ == COMPRESSED_DELTA_TYPE:
+            data = zlib.decompress(data)
+        payload = ormsgpack.unpackb(data)
+        messages = [self.serde.loads_typed(tuple(msg)) for msg in payload["messages"]]
+        return payload["base"], payload["skip"], messages
+
+
+def shared_prefix(old: Sequence[Any], new: Sequence[Any]) -> int:
+    """length of the common prefix of two message lists"""
+    n = 0
+    for a, b in zip(old, new):
+        if a is not b and a != b:
+            break
+        n += 1
+    return n
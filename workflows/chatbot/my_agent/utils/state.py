@@ -1,6 +1,9 @@
 from langgraph.graph import add_messages
 from langchain_core.messages import BaseMessage
-from typing import TypedDict, Annotated, Sequence
+from typing import TypedDict, Annotated, Sequence, NotRequired
 
 class State(TypedDict):
-    messages: Annotated[Sequence[BaseMessage], add_messages]
\ No newline at end of file
+    messages: Annotated[Sequence[BaseMessage], add_messages]
+    # running summary of the messages up to `summarized_until`, see utils/context.py
+    summary: NotRequired[str]
+    summarized_until: NotRequired[str]
\ No newline at end of file
@@ -0,0 +1,21 @@
+import asyncio
+import weakref
+
+# one lock per conversation thread, locks are dropped once no turn holds them
+_thread_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def thread_lock(thread_id: str) -> asyncio.Lock:
+    """
+    get the lock of a conversation thread, so that two turns on the same
+    thread never run the graph at the same time.
+
+    Parameters
+    ----------
+    thread_id : str
+        The thread id used in the graph config.
+    """
+    lock = _thread_locks.get(thread_id)
+    if lock is None:
+        lock = _thread_locks[thread_id] = asyncio.Lock()
+    return lock
@@ -1,10 +1,61 @@
-from langchain_ollama import ChatOllama
+import os
+
+from langchain_core.runnables import RunnableConfig
+
 from .state import State
+from .models import DEFAULT_MODEL, get_model
+from .context import ContextWindow
+from .cache import ResponseCache
+
+# only the summary and the latest turns are sent to the model
+context_window = ContextWindow(
+    max_tokens=int(os.getenv("CHATBOT_CONTEXT_TOKENS", "6000")),
+    mode=os.getenv("CHATBOT_CONTEXT_MODE", "summarize"),
+)
+
+# opt-in cache of model responses, set CHATBOT_RESPONSE_CACHE=1 to enable
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("CHATBOT_RESPONSE_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("CHATBOT_RESPONSE_CACHE_TTL", "3600")),
+    path=os.getenv("CHATBOT_RESPONSE_CACHE_DB") or None,
+    max_disk_entries=int(os.getenv("CHATBOT_RESPONSE_CACHE_DB_SIZE", "100000")),
+) if os.getenv("CHATBOT_RESPONSE_CACHE", "0") == "1" else None
+
+def _cache_key(messages, config: RunnableConfig):
+    """the response cache key, None if caching is disabled for this run"""
+    if response_cache is None or config.get("configurable", {}).get("bypass_cache"):
+        return None
+    return response_cache.key(messages, DEFAULT_MODEL)
 
-def chatbot(state: State):
+def chatbot(state: State, config: RunnableConfig):
     """
     a simple chatbot function that uses the ChatOllama model to respond to messages.
     """
-    # create a ChatOllama instance
-    llm = ChatOllama(model='qwen3:8b', reasoning=False)
-    return {"messages": [llm.invoke(state["messages"])]}
\ No newline at end of file
+    messages = context_window.model_input(state)
+    key = _cache_key(messages, config)
+    if key is not None and (cached := response_cache.get(key)) is not None:
+        return {"messages": [cached]}
+
+    # reuse the process-wide ChatOllama instance and its connection pool
+    llm = get_model()
+    message = llm.invoke(messages)
+    if key is not None:
+        response_cache.put(key, message)
+    return {"messages": [message]}
+
+async def achatbot(state: State, config: RunnableConfig):
+    """
+    async version of `chatbot`, used by `astream`/`ainvoke` so that the model call
+    does not block the event loop and is cancelled together with the graph run.
+    """
+    messages = context_window.model_input(state)
+    key = _cache_key(messages, config)
+    # a cached answer is returned as a whole and streamed as a single chunk
+    if key is not None and (cached := await response_cache.aget(key)) is not None:
+        return {"messages": [cached]}
+
+    llm = get_model()
+    message = await llm.ainvoke(messages)
+    if key is not None:
+        await response_cache.aput(key, message)
+    return {"messages": [message]}
\ No newline at end of file
@@ -19,6 +19,9 @@ function App() {
   const makeId = () =>
     (globalThis.crypto?.randomUUID?.() ?? `${Date.now()}-${Math.random().toString(36).slice(2)}`)
 
+  // each page session is its own conversation thread on the backend
+  const conversationId = useRef(makeId())
+
   // when messages change, scroll to the bottom
   useEffect(() => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' })
@@ -49,7 +52,7 @@ function App() {
     setMessages(prev => [...prev, { id: assistantId, text: '', sender: 'assistant' }])
 
     try {
-      const response = await fetch(`${API_BASE}/chat/stream`, {
+      const response = await fetch(`${API_BASE}/chat/stream?conversation_id=${encodeURIComponent(conversationId.current)}`, {
         method: 'POST',
         headers: {'Content-Type': 'application/json', 'Accept': 'text/event-stream'},
         body: JSON.stringify({ message: rawInput }),